@@ -0,0 +1,279 @@
+"""
+Benchmarks the perception pipeline offline: detect_components, annotate_image and
+each UIED stage traced by driver.trace, over a corpus of stored screenshots with
+canned OCR responses, reporting latency percentiles, peak memory and element counts
+
+    python benchmarks/bench_perception.py [image ...] [--repeat N]
+    python benchmarks/bench_perception.py --save-baseline
+    python benchmarks/bench_perception.py --record-ocr google
+
+The canned OCR of image.png is read from --ocr-dir/image.json, in the format of the
+OCR cache. --record-ocr asks a provider once (network and API key needed) and stores
+its responses there. The committed responses are the word boxes found in the images
+themselves (--record-ocr synthetic), so the text stages see a realistic amount of
+text and every machine benchmarks the same input.
+
+The results are compared against --baseline, exiting with an error when a stage got
+slower or used more memory than --tolerance allows, when the elements found changed,
+or when there is no baseline. Stages are compared on their best time, the sum over
+the images of their fastest run. The committed baseline was measured on a single
+core, another machine should save its own
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "driver", "UIED"))
+sys.path.append(ROOT)
+
+import cv2
+import numpy as np
+
+from driver.annotator import annotate_image
+from driver.frame import Frame
+from driver.ocr_cache import annotated_image_from_dict, annotated_image_to_dict, ocr_cache
+from driver.trace import tracer
+from driver.types import AnnotatedImage, BoundingPoly, DebugConfig, TextAnnotation, Vertex
+from driver.UIED.run_single import detect_components
+
+SAMPLES = [
+    os.path.join(ROOT, "driver", "UIED", "twitter.png"),
+    os.path.join(ROOT, "docs", "screenshot.png"),
+    os.path.join(ROOT, "docs", "annotated_screenshot.png"),
+]
+
+# the canned responses are put in the OCR cache under this provider, so
+# annotate_image finds them there instead of making a request
+CANNED_PROVIDER = "google"
+
+DEBUG: DebugConfig = {
+    "ocr_provider": CANNED_PROVIDER,
+    "ocr_cache": "exact",
+    "ocr_cache_dir": None,
+    "ocr_tiles": (1, 1),
+    "ocr": False,
+    "uied": False,
+    "artifacts": "off",
+    "artifacts_every": 1,
+    "trace": None,
+    "record": None,
+    "replay": None,
+    "annotations": False,
+    "concurrent": False,
+    "incremental": False,
+    "settle_timeout": 0,
+    "settle_threshold": 0,
+    "settle_min_wait": 0,
+}
+
+
+def synthetic_ocr(frame: Frame) -> AnnotatedImage:
+    """
+    Word boxes of the image: high gradient areas closed horizontally, in the format of
+    an OCR response whose first annotation is the whole text
+    """
+    grey = cv2.cvtColor(frame.pixels, cv2.COLOR_BGR2GRAY)
+    gradient = cv2.morphologyEx(grey, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8))
+    _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    words = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, np.ones((1, 9), np.uint8))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(words, connectivity=8)
+
+    def box(description, x, y, w, h):
+        vertices = [Vertex(x, y), Vertex(x + w, y), Vertex(x + w, y + h), Vertex(x, y + h)]
+        return TextAnnotation(description, BoundingPoly(vertices))
+
+    annotations = [box("", 0, 0, frame.width, frame.height)]
+    for i, (x, y, w, h, _) in enumerate(stats[1:count].tolist()):
+        # text sized boxes only
+        if 8 <= h <= 40 and 8 <= w <= 400 and w >= h:
+            annotations.append(box(f"word{i}", x, y, w, h))
+    return AnnotatedImage(annotations)
+
+
+def canned_ocr(path: str, ocr_dir: str, frame: Frame) -> AnnotatedImage:
+    canned_path = os.path.join(ocr_dir, os.path.splitext(os.path.basename(path))[0] + ".json")
+    if not os.path.exists(canned_path):
+        print(f"No canned OCR in {canned_path}, using word boxes found in the image")
+        return synthetic_ocr(frame)
+    with open(canned_path) as f:
+        return annotated_image_from_dict(json.load(f))
+
+
+def record_ocr(paths, ocr_dir: str, provider: str):
+    from driver.ocr_call import provider_text_detect
+
+    os.makedirs(ocr_dir, exist_ok=True)
+    for path in paths:
+        if provider == "synthetic":
+            result = synthetic_ocr(Frame.from_file(path))
+        else:
+            result = provider_text_detect(Frame.from_file(path), provider)
+        canned_path = os.path.join(ocr_dir, os.path.splitext(os.path.basename(path))[0] + ".json")
+        with open(canned_path, "w") as f:
+            json.dump(annotated_image_to_dict(result), f)
+        print(f"Recorded {len(result.text_annotations)} annotations to {canned_path}")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def element_counts(components, label_map):
+    categories = [element.category for element in components["compos"]]
+    return {
+        "elements": len(categories),
+        "texts": categories.count("Text"),
+        "labels": len(label_map),
+    }
+
+
+def bench_image(path: str, ocr_dir: str, repeat: int):
+    """
+    :return: durations in seconds of every stage over the runs, peak memory in bytes
+             of detect_components and annotate_image, element counts
+    """
+    frame = Frame.from_file(path)
+    ocr_result = canned_ocr(path, ocr_dir, frame)
+    ocr_cache.remember(ocr_cache.key(frame, CANNED_PROVIDER, "exact"), ocr_result)
+
+    # first run untimed, for the lazy imports and initializations
+    detect_components(Frame(frame.pixels.copy(), name=frame.name), ocr_result)
+    annotate_image(Frame(frame.pixels.copy(), name=frame.name), DEBUG)
+
+    tracer.durations.clear()
+    durations = {"detect_components": [], "annotate_image": []}
+    # as timeit does, so a collection does not land on a random stage
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            # a new frame every run, so nothing cached on the frame carries over
+            run_frame = Frame(frame.pixels.copy(), name=frame.name)
+            start = time.perf_counter()
+            components = detect_components(run_frame, ocr_result)
+            durations["detect_components"].append(time.perf_counter() - start)
+
+            run_frame = Frame(frame.pixels.copy(), name=frame.name)
+            start = time.perf_counter()
+            label_map, _, _ = annotate_image(run_frame, DEBUG)
+            durations["annotate_image"].append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    # the stages of both detect_components and annotate_image
+    for name, stage_durations in tracer.durations.items():
+        durations[name] = list(stage_durations)
+
+    # memory is measured on its own run, tracing allocations slows everything down
+    peak_memory = {}
+    for name, run in [
+        ("detect_components", lambda run_frame: detect_components(run_frame, ocr_result)),
+        ("annotate_image", lambda run_frame: annotate_image(run_frame, DEBUG)),
+    ]:
+        run_frame = Frame(frame.pixels.copy(), name=frame.name)
+        tracemalloc.start()
+        run(run_frame)
+        peak_memory[name] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return durations, peak_memory, element_counts(components, label_map)
+
+
+def compare(results, baseline, tolerance: float, min_ms: float):
+    """
+    :return: the regressions against the baseline
+    """
+    regressions = []
+    for stage, stats in results["stages"].items():
+        before = baseline["stages"].get(stage)
+        if before is None:
+            continue
+        # the fastest run of each image, what the code costs without the noise of the
+        # machine, which moves the median and the tail by a third from one run to the next
+        if stats["best"] > before["best"] * (1 + tolerance) and stats["best"] - before["best"] > min_ms:
+            regressions.append(f"{stage} best {before['best']:.1f}ms -> {stats['best']:.1f}ms")
+    for image, memory in results["peak_memory"].items():
+        for stage, peak in memory.items():
+            before = baseline["peak_memory"].get(image, {}).get(stage)
+            if before is not None and peak > before * (1 + tolerance):
+                regressions.append(f"{image} {stage} peak memory {before / 2**20:.1f}MB -> {peak / 2**20:.1f}MB")
+    for image, counts in results["counts"].items():
+        before = baseline["counts"].get(image)
+        if before is not None and before != counts:
+            regressions.append(f"{image} elements changed {before} -> {counts}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", default=SAMPLES)
+    parser.add_argument("--ocr-dir", default=os.path.join(ROOT, "benchmarks", "ocr"))
+    parser.add_argument("--record-ocr", choices=["azure", "google", "baidu", "tesseract", "synthetic"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=os.path.join(ROOT, "benchmarks", "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown ratio, default to 0.5 as a shared machine runs up to 45%% slower from one run to the next")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="Slowdowns smaller than this are noise, default to 2ms")
+    args = parser.parse_args()
+
+    if args.record_ocr:
+        record_ocr(args.images, args.ocr_dir, args.record_ocr)
+        return
+
+    durations = {}
+    # sum over the images of the fastest run of each stage
+    best = {}
+    results = {"stages": {}, "peak_memory": {}, "counts": {}}
+    for path in args.images:
+        image = os.path.basename(path)
+        image_durations, peak_memory, counts = bench_image(path, args.ocr_dir, args.repeat)
+        for name, stage_durations in image_durations.items():
+            durations.setdefault(name, []).extend(stage_durations)
+            best[name] = best.get(name, 0) + min(stage_durations)
+        results["peak_memory"][image] = peak_memory
+        results["counts"][image] = counts
+        memory = ", ".join(f"{name} {peak / 2**20:.1f}MB" for name, peak in peak_memory.items())
+        print(f"{image}: {counts['elements']} elements, {counts['texts']} texts, {counts['labels']} labels, peak {memory}")
+
+    print(f"\n{'stage':<20}{'runs':>6}{'best ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name, stage_durations in durations.items():
+        stats = {
+            "best": best[name] * 1000,
+            "p50": percentile(stage_durations, 0.5) * 1000,
+            "p95": percentile(stage_durations, 0.95) * 1000,
+            "max": max(stage_durations) * 1000,
+        }
+        results["stages"][name] = stats
+        print(
+            f"{name:<20}{len(stage_durations):>6}{stats['best']:>10.1f}{stats['p50']:>10.1f}"
+            f"{stats['p95']:>10.1f}{stats['max']:>10.1f}"
+        )
+    # ru_maxrss is in kilobytes on Linux
+    print(f"\nPeak resident memory of the process: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f}MB")
+    # the stages were reported above, not again by the tracer on exit
+    tracer.durations.clear()
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved the baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline in {args.baseline} to compare against, save one with --save-baseline")
+        sys.exit(1)
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance, args.min_ms)
+    if len(regressions) > 0:
+        print("\nREGRESSIONS against the baseline:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+    print("\nNo regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Compares ip_detection.rm_line against the per-pixel implementation it replaced,
+checking both erase the same lines from the binary map of the sample screenshots
+
+    python benchmarks/bench_rm_line.py [image ...]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "driver", "UIED"))
+sys.path.append(ROOT)
+
+import numpy as np
+
+import detect_compo.lib_ip.ip_detection as det
+import detect_compo.lib_ip.ip_preprocessing as pre
+from driver.frame import Frame
+
+SAMPLES = [
+    os.path.join(ROOT, "driver", "UIED", "twitter.png"),
+    os.path.join(ROOT, "docs", "screenshot.png"),
+    os.path.join(ROOT, "docs", "annotated_screenshot.png"),
+]
+
+
+def rm_line_reference(binary, max_line_thickness=8):
+    """
+    rm_line as it was before, looping over every pixel of every row
+    """
+
+    def is_valid_line(line):
+        line_length = 0
+        line_gap = 0
+        for j in line:
+            if j > 0:
+                if line_gap > 5:
+                    return False
+                line_length += 1
+                line_gap = 0
+            elif line_length > 0:
+                line_gap += 1
+        if line_length / width > 0.95:
+            return True
+        return False
+
+    height, width = binary.shape[:2]
+
+    start_row, end_row = -1, -1
+    check_line = False
+    check_gap = False
+    for i, row in enumerate(binary):
+        if is_valid_line(row):
+            if not check_line:
+                start_row = i
+                check_line = True
+        else:
+            if check_line:
+                if i - start_row < max_line_thickness:
+                    end_row = i
+                    check_gap = True
+                else:
+                    start_row, end_row = -1, -1
+                check_line = False
+        if check_gap and i - end_row > max_line_thickness:
+            binary[start_row:end_row] = 0
+            start_row, end_row = -1, -1
+            check_line = False
+            check_gap = False
+
+    if (check_line and (height - start_row) < max_line_thickness) or check_gap:
+        binary[start_row:end_row] = 0
+
+
+def timed(function, binary, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        copy = binary.copy()
+        start = time.perf_counter()
+        function(copy)
+        best = min(best, time.perf_counter() - start)
+    return best, copy
+
+
+def main():
+    images = sys.argv[1:] or SAMPLES
+    for path in images:
+        frame = Frame.from_file(path)
+        org, _ = pre.read_frame(frame, 982 if frame.height > frame.width else int(982 * frame.height / frame.width))
+        binary = pre.binarization(org, grad_min=10)
+        # a few full width lines, the case that matters the most for rm_line
+        for row in range(100, binary.shape[0], 200):
+            binary[row : row + 2] = 255
+
+        reference_time, reference = timed(rm_line_reference, binary, repeat=3)
+        vectorized_time, vectorized = timed(det.rm_line, binary, repeat=10)
+        print(
+            f"{os.path.basename(path)} {binary.shape[1]}x{binary.shape[0]}: "
+            f"reference {reference_time * 1000:.1f}ms, "
+            f"vectorized {vectorized_time * 1000:.1f}ms "
+            f"({reference_time / vectorized_time:.0f}x), "
+            f"identical: {np.array_equal(reference, vectorized)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
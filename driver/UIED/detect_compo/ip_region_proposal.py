@@ -1,30 +1,34 @@
 import cv2
 from os.path import join as pjoin
-import time
 import json
-import numpy as np
 
 import detect_compo.lib_ip.ip_preprocessing as pre
 import detect_compo.lib_ip.ip_draw as draw
 import detect_compo.lib_ip.ip_detection as det
+import detect_compo.lib_ip.ip_nesting as nesting
 import detect_compo.lib_ip.file_utils as file
 import detect_compo.lib_ip.Component as Compo
+from detect_compo.lib_ip.ip_integral import RegionStats
 from config.CONFIG_UIED import Config
+from driver.trace import span
 C = Config()
 
 
 def nesting_inspection(org, grey, compos, ffl_block):
     '''
-    Inspect all big compos through block division by flood-fill
+    Inspect all big compos through block division by flood-fill, see ip_nesting
     :param ffl_block: gradient threshold for flood-fill
     :return: nesting compos
     '''
     nesting_compos = []
+    big_compos = [compo for compo in compos if compo.height > 50]
+    # the regions of every clip are labelled from one map of the whole image
+    nested = nesting.nested_components_of_compos(grey, big_compos, grad_thresh=ffl_block)
+    nested = dict(zip([id(compo) for compo in big_compos], nested))
     for i, compo in enumerate(compos):
-        if compo.height > 50:
+        if id(compo) in nested:
             replace = False
-            clip_grey = compo.compo_clipping(grey)
-            n_compos = det.nested_components_detection(clip_grey, org, grad_thresh=ffl_block, show=False)
+            n_compos = nested[id(compo)]
             Compo.cvt_compos_relative_pos(n_compos, compo.bbox.col_min, compo.bbox.row_min)
 
             for n_compo in n_compos:
@@ -37,34 +41,41 @@ def nesting_inspection(org, grey, compos, ffl_block):
     return nesting_compos
 
 
-def compo_detection(input_img_path, output_root, uied_params,
-                    resize_by_height=800, classifier=None, show=False, wai_key=0):
-
-    start = time.time()
-    name = input_img_path.split('/')[-1][:-4] if '/' in input_img_path else input_img_path.split('\\')[-1][:-4]
-    ip_root = file.build_directory(pjoin(output_root, "ip"))
+def compo_detection(frame, output_root, uied_params,
+                    resize_by_height=800, classifier=None, show=False, wai_key=0, artifacts=None):
+    '''
+    :param artifacts: driver.artifacts.ArtifactSink the drawn compos and json are written to, nothing is written without it
+    '''
+    name = frame.name
+    ip_root = pjoin(output_root, "ip")
 
     # *** Step 1 *** pre-processing: read img -> get binary map
-    org, grey = pre.read_img(input_img_path, resize_by_height)
-    binary = pre.binarization(org, grad_min=int(uied_params['min-grad']))
+    with span('binarization'):
+        org, grey = pre.read_frame(frame, resize_by_height)
+        binary = pre.binarization(org, grad_min=int(uied_params['min-grad']))
 
     # *** Step 2 *** element detection
-    det.rm_line(binary, show=show, wait_key=wai_key)
-    uicompos = det.component_detection(binary, min_obj_area=int(uied_params['min-ele-area']))
+    with span('component_detection'):
+        det.rm_line(binary, show=show, wait_key=wai_key)
+        uicompos = det.component_detection_cc(binary, min_obj_area=int(uied_params['min-ele-area']))
+        uicompos = det.compo_filter(uicompos, min_area=int(uied_params['min-ele-area']), img_shape=binary.shape)
 
-    # *** Step 3 *** results refinement
-    uicompos = det.compo_filter(uicompos, min_area=int(uied_params['min-ele-area']), img_shape=binary.shape)
-    uicompos = det.merge_intersected_compos(uicompos)
-    det.compo_block_recognition(binary, uicompos)
-    if uied_params['merge-contained-ele']:
-        uicompos = det.rm_contained_compos_not_in_block(uicompos)
-    Compo.compos_update(uicompos, org.shape)
-    Compo.compos_containment(uicompos)
+        # *** Step 3 *** results refinement
+        uicompos = det.merge_intersected_compos(uicompos)
+        det.compo_block_recognition(binary, uicompos, stats=RegionStats(binary))
+        if uied_params['merge-contained-ele']:
+            uicompos = det.rm_contained_compos_not_in_block(uicompos)
+        Compo.compos_update(uicompos, org.shape)
+        Compo.compos_containment(uicompos)
 
     # *** Step 4 ** nesting inspection: check if big compos have nesting element
-    uicompos += nesting_inspection(org, grey, uicompos, ffl_block=uied_params['ffl-block'])
+    with span('nesting'):
+        uicompos += nesting_inspection(org, grey, uicompos, ffl_block=uied_params['ffl-block'])
     Compo.compos_update(uicompos, org.shape)
-    draw.draw_bounding_box(org, uicompos, show=show, name='merged compo', write_path=pjoin(ip_root, name + '.jpg'), wait_key=wai_key)
+    draw.draw_bounding_box(org, uicompos, show=show, name='merged compo', wait_key=wai_key)
+    if artifacts is not None:
+        drawn = list(uicompos)
+        artifacts.image(pjoin(ip_root, name + '.jpg'), lambda: draw.draw_bounding_box(org, drawn, is_return=True))
 
     # *** Step 5 *** image inspection: recognize image -> remove noise in image -> binarize with larger threshold and reverse -> rectangular compo detection
     # if classifier is not None:
@@ -87,6 +98,8 @@ def compo_detection(input_img_path, output_root, uied_params,
 
     # *** Step 7 *** save detection result
     Compo.compos_update(uicompos, org.shape)
-    uicompos = file.save_corners_json(pjoin(ip_root, name + '.json'), uicompos)
+    uicompos = file.corners_json(uicompos)
+    if artifacts is not None:
+        artifacts.json(pjoin(ip_root, name + '.json'), lambda: uicompos)
 
     return uicompos
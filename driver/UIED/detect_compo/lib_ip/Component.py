@@ -1,7 +1,10 @@
 from detect_compo.lib_ip.Bbox import Bbox
 import detect_compo.lib_ip.ip_draw as draw
+import detect_compo.lib_ip.ip_geometry as geometry
+import detect_compo.lib_ip.ip_spatial as spatial
 
 import cv2
+import numpy as np
 
 
 def cvt_compos_relative_pos(compos, col_min_base, row_min_base):
@@ -10,13 +13,15 @@ def cvt_compos_relative_pos(compos, col_min_base, row_min_base):
 
 
 def compos_containment(compos):
-    for i in range(len(compos) - 1):
-        for j in range(i + 1, len(compos)):
-            relation = compos[i].compo_relation(compos[j])
-            if relation == -1:
-                compos[j].contain.append(i)
-            if relation == 1:
-                compos[i].contain.append(j)
+    # only intersected compos can contain one another
+    boxes = geometry.as_boxes([compo.put_bbox() for compo in compos])
+    firsts, seconds = geometry.split_pairs(spatial.intersected_pairs(boxes))
+    relations = geometry.bbox_relations_nms(boxes[firsts], boxes[seconds])
+    for i, j, relation in zip(firsts.tolist(), seconds.tolist(), relations.tolist()):
+        if relation == -1:
+            compos[j].contain.append(i)
+        if relation == 1:
+            compos[i].contain.append(j)
 
 
 def compos_update(compos, org_shape):
@@ -26,16 +31,28 @@ def compos_update(compos, org_shape):
 
 
 class Component:
+    __slots__ = ('id', 'points', '_region', '_boundary', 'bbox', 'bbox_area', 'region_area',
+                 'width', 'height', 'image_shape', 'area', 'category', 'contain',
+                 'rect_', 'line_', 'redundant')
+
     def __init__(self, region, image_shape):
+        '''
+        :param region: pixels of the object as a (n, 2) array or list of (row_index, column_index)
+        '''
         self.id = None
-        self.region = region
-        self.boundary = self.compo_get_boundary()
-        self.bbox = self.compo_get_bbox()
+        self.points = np.asarray(region, dtype=np.int32).reshape(-1, 2)
+        # per-pixel list and boundary are only built when something asks for them
+        self._region = None
+        self._boundary = None
+
+        rows, columns = self.points[:, 0], self.points[:, 1]
+        self.bbox = Bbox(int(columns.min()), int(rows.min()), int(columns.max()), int(rows.max()))
         self.bbox_area = self.bbox.box_area
 
-        self.region_area = len(region)
-        self.width = len(self.boundary[0])
-        self.height = len(self.boundary[2])
+        self.region_area = len(self.points)
+        # number of distinct columns and rows covered, the lengths of the boundaries
+        self.width = int(np.count_nonzero(np.bincount(columns - self.bbox.col_min)))
+        self.height = int(np.count_nonzero(np.bincount(rows - self.bbox.row_min)))
         self.image_shape = image_shape
         self.area = self.width * self.height
 
@@ -46,6 +63,18 @@ class Component:
         self.line_ = None
         self.redundant = False
 
+    @property
+    def region(self):
+        if self._region is None:
+            self._region = [(int(row), int(column)) for row, column in self.points]
+        return self._region
+
+    @property
+    def boundary(self):
+        if self._boundary is None:
+            self._boundary = self.compo_get_boundary()
+        return self._boundary
+
     def compo_update(self, id, org_shape):
         self.id = id
         self.image_shape = org_shape
@@ -67,26 +96,26 @@ class Component:
         -> up, bottom: (column_index, min/max row border)
         -> left, right: (row_index, min/max column border) detect range of each row
         '''
-        border_up, border_bottom, border_left, border_right = {}, {}, {}, {}
-        for point in self.region:
-            # point: (row_index, column_index)
-            # up, bottom: (column_index, min/max row border) detect range of each column
-            if point[1] not in border_up or border_up[point[1]] > point[0]:
-                border_up[point[1]] = point[0]
-            if point[1] not in border_bottom or border_bottom[point[1]] < point[0]:
-                border_bottom[point[1]] = point[0]
-            # left, right: (row_index, min/max column border) detect range of each row
-            if point[0] not in border_left or border_left[point[0]] > point[1]:
-                border_left[point[0]] = point[1]
-            if point[0] not in border_right or border_right[point[0]] < point[1]:
-                border_right[point[0]] = point[1]
-
-        boundary = [border_up, border_bottom, border_left, border_right]
-        # descending sort
-        for i in range(len(boundary)):
-            boundary[i] = [[k, boundary[i][k]] for k in boundary[i].keys()]
-            boundary[i] = sorted(boundary[i], key=lambda x: x[0])
-        return boundary
+        rows, columns = self.points[:, 0], self.points[:, 1]
+
+        def borders(keys, values):
+            # min and max value for each distinct key, sorted by key
+            offset = keys.min()
+            size = keys.max() - offset + 1
+            low = np.full(size, np.iinfo(np.int32).max, dtype=np.int32)
+            high = np.full(size, -1, dtype=np.int32)
+            np.minimum.at(low, keys - offset, values)
+            np.maximum.at(high, keys - offset, values)
+            present = np.flatnonzero(high >= 0)
+            present_keys = (present + offset).tolist()
+            return ([list(pair) for pair in zip(present_keys, low[present].tolist())],
+                    [list(pair) for pair in zip(present_keys, high[present].tolist())])
+
+        # up, bottom: (column_index, min/max row border) detect range of each column
+        border_up, border_bottom = borders(columns, rows)
+        # left, right: (row_index, min/max column border) detect range of each row
+        border_left, border_right = borders(rows, columns)
+        return [border_up, border_bottom, border_left, border_right]
 
     def compo_get_bbox(self):
         """
@@ -108,25 +137,27 @@ class Component:
         detect if an object is rectangle by evenness and dent of each border
         '''
         dent_direction = [1, -1, 1, -1]  # direction for convex
+        boundary = self.boundary
 
         flat = 0
         parameter = 0
-        for n, border in enumerate(self.boundary):
+        for n, border in enumerate(boundary):
             parameter += len(border)
             # dent detection
             pit = 0  # length of pit
             depth = 0  # the degree of surface changing
             if n <= 1:
-                adj_side = max(len(self.boundary[2]), len(self.boundary[3]))  # get maximum length of adjacent side
+                adj_side = max(len(boundary[2]), len(boundary[3]))  # get maximum length of adjacent side
             else:
-                adj_side = max(len(self.boundary[0]), len(self.boundary[1]))
+                adj_side = max(len(boundary[0]), len(boundary[1]))
 
             # -> up, bottom: (column_index, min/max row border)
             # -> left, right: (row_index, min/max column border) detect range of each row
             abnm = 0
+            values = [value for _, value in border]
             for i in range(int(3 + len(border) * 0.02), len(border) - 1):
                 # calculate gradient
-                difference = border[i][1] - border[i + 1][1]
+                difference = values[i] - values[i + 1]
                 # the degree of surface changing
                 depth += difference
                 # ignore noise at the start of each direction
@@ -187,20 +218,15 @@ class Component:
         :param min_line_thickness:
         :return: Boolean
         """
+        up, bottom, left, right = ([value for _, value in border] for border in self.boundary)
         # horizontally
-        slim = 0
-        for i in range(self.width):
-            if abs(self.boundary[1][i][1] - self.boundary[0][i][1]) <= min_line_thickness:
-                slim += 1
-        if slim / len(self.boundary[0]) > 0.93:
+        slim = np.count_nonzero(np.abs(np.subtract(bottom[:self.width], up[:self.width])) <= min_line_thickness)
+        if slim / len(up) > 0.93:
             self.line_ = True
             return True
         # vertically
-        slim = 0
-        for i in range(self.height):
-            if abs(self.boundary[2][i][1] - self.boundary[3][i][1]) <= min_line_thickness:
-                slim += 1
-        if slim / len(self.boundary[2]) > 0.93:
+        slim = np.count_nonzero(np.abs(np.subtract(left[:self.height], right[:self.height])) <= min_line_thickness)
+        if slim / len(left) > 0.93:
             self.line_ = True
             return True
         self.line_ = False
@@ -25,10 +25,9 @@ def save_corners(file_path, corners, compo_name, clear=True):
     df.to_csv(file_path)
 
 
-def save_corners_json(file_path, compos):
+def corners_json(compos):
     img_shape = compos[0].image_shape if len(compos) > 0 else None
     output = {'img_shape': img_shape, 'compos': []}
-    f_out = open(file_path, 'w')
 
     for compo in compos:
         c = {'id': compo.id, 'class': compo.category}
@@ -36,8 +35,13 @@ def save_corners_json(file_path, compos):
         c['width'] = compo.width
         c['height'] = compo.height
         output['compos'].append(c)
+    return output
 
-    json.dump(output, f_out, indent=4)
+
+def save_corners_json(file_path, compos):
+    output = corners_json(compos)
+    with open(file_path, 'w') as f_out:
+        json.dump(output, f_out, indent=4)
 
     return output
 
@@ -3,7 +3,10 @@ import numpy as np
 
 import detect_compo.lib_ip.ip_draw as draw
 import detect_compo.lib_ip.ip_preprocessing as pre
+import detect_compo.lib_ip.ip_geometry as geometry
+import detect_compo.lib_ip.ip_spatial as spatial
 from detect_compo.lib_ip.Component import Component
+from detect_compo.lib_ip.ip_integral import RegionStats
 import detect_compo.lib_ip.Component as Compo
 from config.CONFIG_UIED import Config
 C = Config()
@@ -51,19 +54,30 @@ def merge_intersected_corner(compos, org, is_merge_contained_ele, max_gap=(0, 0)
 
 
 def merge_intersected_compos(compos):
+    # only intersected compos merge, so compos too far apart to ever meet are merged separately
+    return spatial.merge_by_group(compos, [compo.put_bbox() for compo in compos], (0, 0),
+                                  merge_intersected_compos_in_group)
+
+
+def merge_intersected_compos_in_group(compos):
     changed = True
     while changed:
         changed = False
         temp_set = []
+        index = spatial.GridIndex()
         for compo_a in compos:
             merged = False
-            for compo_b in temp_set:
+            # the first compo of temp_set intersecting compo_a, as temp_set is in insertion order
+            for k in index.query(compo_a.put_bbox()):
+                compo_b = temp_set[k]
                 if compo_a.compo_relation(compo_b) == 2:
                     compo_b.compo_merge(compo_a)
+                    index.update(k, compo_b.put_bbox())
                     merged = True
                     changed = True
                     break
             if not merged:
+                index.insert(len(temp_set), compo_a.put_bbox())
                 temp_set.append(compo_a)
         compos = temp_set.copy()
     return compos
@@ -74,13 +88,14 @@ def rm_contained_compos_not_in_block(compos):
     remove all components contained by others that are not Block
     '''
     marked = np.full(len(compos), False)
-    for i in range(len(compos) - 1):
-        for j in range(i + 1, len(compos)):
-            relation = compos[i].compo_relation(compos[j])
-            if relation == -1 and compos[j].category != 'Block':
-                marked[i] = True
-            if relation == 1 and compos[i].category != 'Block':
-                marked[j] = True
+    boxes = geometry.as_boxes([compo.put_bbox() for compo in compos])
+    firsts, seconds = geometry.split_pairs(spatial.intersected_pairs(boxes))
+    relations = geometry.bbox_relations_nms(boxes[firsts], boxes[seconds])
+    for i, j, relation in zip(firsts.tolist(), seconds.tolist(), relations.tolist()):
+        if relation == -1 and compos[j].category != 'Block':
+            marked[i] = True
+        if relation == 1 and compos[i].category != 'Block':
+            marked[j] = True
     new_compos = []
     for i in range(len(marked)):
         if not marked[i]:
@@ -223,35 +238,53 @@ def rm_line_v_h(binary, show=False, max_line_thickness=C.THRESHOLD_LINE_THICKNES
         cv2.waitKey()
 
 
+def valid_line_rows(binary, min_line_length_ratio=C.THRESHOLD_LINE_MIN_LENGTH, max_gap=5):
+    '''
+    Rows of the binary map that look like a horizontal line: foreground on more than
+    min_line_length_ratio of the width, with no gap longer than max_gap between its pixels
+    :return: boolean array, one per row
+    '''
+    foreground = binary > 0
+    valid = foreground.sum(axis=1) / binary.shape[1] > min_line_length_ratio
+    # only the few rows long enough to be a line need their gaps measured
+    for i in np.flatnonzero(valid):
+        gaps = np.diff(np.flatnonzero(foreground[i])) - 1
+        if len(gaps) > 0 and gaps.max() > max_gap:
+            valid[i] = False
+    return valid
+
+
 def rm_line(binary,
             max_line_thickness=C.THRESHOLD_LINE_THICKNESS,
             min_line_length_ratio=C.THRESHOLD_LINE_MIN_LENGTH,
+            vertical=False,
             show=False, wait_key=0):
-    def is_valid_line(line):
-        line_length = 0
-        line_gap = 0
-        for j in line:
-            if j > 0:
-                if line_gap > 5:
-                    return False
-                line_length += 1
-                line_gap = 0
-            elif line_length > 0:
-                line_gap += 1
-        if line_length / width > 0.95:
-            return True
-        return False
+    '''
+    Erase the thin horizontal lines crossing the whole binary map, in place
+    :param vertical: erase the vertical lines too
+    '''
+    rm_horizontal_line(binary, max_line_thickness, min_line_length_ratio)
+    if vertical:
+        # the transpose is a view, erasing its rows erases the columns of binary
+        rm_horizontal_line(binary.T, max_line_thickness, min_line_length_ratio)
+
+    if show:
+        cv2.imshow('no-line binary', binary)
+        if wait_key is not None:
+            cv2.waitKey(wait_key)
+        if wait_key == 0:
+            cv2.destroyWindow('no-line binary')
 
-    height, width = binary.shape[:2]
-    board = np.zeros(binary.shape[:2], dtype=np.uint8)
+
+def rm_horizontal_line(binary, max_line_thickness, min_line_length_ratio):
+    height = binary.shape[0]
+    valid_rows = valid_line_rows(binary, min_line_length_ratio)
 
     start_row, end_row = -1, -1
     check_line = False
     check_gap = False
-    for i, row in enumerate(binary):
-        # line_ratio = (sum(row) / 255) / width
-        # if line_ratio > 0.9:
-        if is_valid_line(row):
+    for i, is_valid_line in enumerate(valid_rows.tolist()):
+        if is_valid_line:
             # new start: if it is checking a new line, mark this row as start
             if not check_line:
                 start_row = i
@@ -276,13 +309,6 @@ def rm_line(binary,
     if (check_line and (height - start_row) < max_line_thickness) or check_gap:
         binary[start_row: end_row] = 0
 
-    if show:
-        cv2.imshow('no-line binary', binary)
-        if wait_key is not None:
-            cv2.waitKey(wait_key)
-        if wait_key == 0:
-            cv2.destroyWindow('no-line binary')
-
 
 def rm_noise_compos(compos):
     compos_new = []
@@ -357,43 +383,56 @@ def is_block(clip, thread=0.15):
     Block is a rectangle border enclosing a group of compos (consider it as a wireframe)
     Check if a compo is block by checking if the inner side of its border is blank
     '''
-    side = 4  # scan 4 lines inner forward each border
-    # top border - scan top down
-    blank_count = 0
-    for i in range(1, 5):
-        if sum(clip[side + i]) / 255 > thread * clip.shape[1]:
-            blank_count += 1
-    if blank_count > 2: return False
-    # left border - scan left to right
-    blank_count = 0
-    for i in range(1, 5):
-        if sum(clip[:, side + i]) / 255 > thread * clip.shape[0]:
-            blank_count += 1
-    if blank_count > 2: return False
-
-    side = -4
-    # bottom border - scan bottom up
-    blank_count = 0
-    for i in range(-1, -5, -1):
-        if sum(clip[side + i]) / 255 > thread * clip.shape[1]:
-            blank_count += 1
-    if blank_count > 2: return False
-    # right border - scan right to left
-    blank_count = 0
-    for i in range(-1, -5, -1):
-        if sum(clip[:, side + i]) / 255 > thread * clip.shape[0]:
-            blank_count += 1
-    if blank_count > 2: return False
-    return True
-
-
-def compo_block_recognition(binary, compos, block_side_length=0.15):
+    return bool(are_blocks(RegionStats(clip), [(0, 0, clip.shape[1], clip.shape[0])], thread)[0])
+
+
+def are_blocks(stats, boxes, thread=0.15, side=4, lines=4):
+    '''
+    is_block for many clips of the same binary map at once
+    :param stats: RegionStats of the binary map
+    :param boxes: (column_min, row_min, column_max, row_max) of each clip, max excluded
+    :return: bool array, True for the blocks
+    '''
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    col_min, row_min, col_max, row_max = (v[:, None] for v in boxes.T)
+    height, width = row_max - row_min, col_max - col_min
+    # scan the 4 lines inner forward each border, e.g. rows 5 to 8 and -5 to -8 of the clip
+    offsets = np.arange(side + 1, side + lines + 1)
+    top, bottom = row_min + offsets, row_max - offsets
+    left, right = col_min + offsets, col_max - offsets
+
+    # clips too small to have lines that far from the border are not blocks
+    blocks = ((height > side + lines) & (width > side + lines))[:, 0]
+    # a border with more than 2 of its inner lines filled is not blank
+    # the sums are exact, the former sum() of uint8 lines wrapped modulo 256 under NumPy 2 and
+    # made filled lines look blank, e.g. (302, 300, 635, 489) of twitter.png was taken for a block
+    for sums, length in ((stats.sums(col_min, top, col_max, top + 1), width),
+                         (stats.sums(left, row_min, left + 1, row_max), height),
+                         (stats.sums(col_min, bottom, col_max, bottom + 1), width),
+                         (stats.sums(right, row_min, right + 1, row_max), height)):
+        filled = np.count_nonzero(sums / 255 > thread * length, axis=1)
+        blocks = blocks & (filled <= 2)
+    return blocks
+
+
+def compo_block_recognition(binary, compos, block_side_length=0.15, stats=None):
+    '''
+    :param stats: RegionStats of the binary map, if already built
+    '''
     height, width = binary.shape
-    for compo in compos:
-        if compo.height / height > block_side_length and compo.width / width > block_side_length:
-            clip = compo.compo_clipping(binary)
-            if is_block(clip):
-                compo.category = 'Block'
+    candidates = [compo for compo in compos
+                  if compo.height / height > block_side_length and compo.width / width > block_side_length]
+    if len(candidates) == 0:
+        return
+    if stats is None:
+        stats = RegionStats(binary)
+    # the same clips as compo_clipping
+    boxes = np.array([compo.put_bbox() for compo in candidates])
+    boxes[:, 2] = np.minimum(boxes[:, 2], width)
+    boxes[:, 3] = np.minimum(boxes[:, 3], height)
+    for compo, block in zip(candidates, are_blocks(stats, boxes)):
+        if block:
+            compo.category = 'Block'
 
 
 # take the binary image as input
@@ -431,8 +470,8 @@ def component_detection(binary, min_obj_area,
                 ff = cv2.floodFill(binary, mask, (j, i), None, 0, 0, cv2.FLOODFILL_MASK_ONLY)
                 if ff[0] < min_obj_area: continue
                 mask_copy = mask - mask_copy
-                region = np.reshape(cv2.findNonZero(mask_copy[1:-1, 1:-1]), (-1, 2))
-                region = [(p[1], p[0]) for p in region]
+                # findNonZero gives (column, row) points
+                region = np.reshape(cv2.findNonZero(mask_copy[1:-1, 1:-1]), (-1, 2))[:, ::-1]
 
                 # filter out some compos
                 component = Component(region, binary.shape)
@@ -470,6 +509,90 @@ def component_detection(binary, min_obj_area,
         return compos_all
 
 
+def component_detection_cc(binary, min_obj_area,
+                           line_thickness=C.THRESHOLD_LINE_THICKNESS,
+                           min_rec_evenness=C.THRESHOLD_REC_MIN_EVENNESS,
+                           max_dent_ratio=C.THRESHOLD_REC_MAX_DENT_RATIO,
+                           step_h = 5, step_v = 2,
+                           rec_detect=False, show=False, test=False):
+    """
+    Same result as component_detection, labelling the whole binary map in a single
+    connectedComponentsWithStats pass instead of flood filling from every seed.
+    Like the flood fill, only components hit by a seed of the step_h x step_v grid
+    are kept, in the order their first seed is met
+    """
+    foreground = (binary == 255).astype(np.uint8)
+    # floodFill uses 4-connectivity by default
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(foreground, connectivity=4)
+
+    # labels under the seeds and under the pixel up-left of them, row by row in the
+    # same order as the flood fill loop, rows alternating between even and odd columns.
+    # component_detection checks the flood fill mask at [i, j] without its 1px border
+    # offset, i.e. the pixel at [i - 1, j - 1], and floodFill sets that border to 1,
+    # so a seed is skipped when the component up-left of it was already found, and
+    # seeds on the first row or column are skipped after the first fill.
+    # Keep both so the components found don't change
+    border = -1
+    seed_labels, diagonal_labels = [], []
+    for i in range(0, binary.shape[0], step_h):
+        columns = np.arange(i % 2, binary.shape[1], step_v)
+        seed_labels.append(labels[i, columns])
+        diagonal = np.full(len(columns), border, dtype=labels.dtype)
+        if i > 0:
+            inner = columns > 0
+            diagonal[inner] = labels[i - 1, columns[inner] - 1]
+        diagonal_labels.append(diagonal)
+    seed_labels = np.concatenate(seed_labels)
+    diagonal_labels = np.concatenate(diagonal_labels)
+
+    # label 0 is the background
+    on_foreground = seed_labels != 0
+    found = set()
+    seeded = []
+    for label, diagonal in zip(seed_labels[on_foreground].tolist(), diagonal_labels[on_foreground].tolist()):
+        if label in found or diagonal in found:
+            continue
+        found.update((label, border))
+        if stats[label, cv2.CC_STAT_AREA] >= min_obj_area:
+            seeded.append(label)
+
+    compos_all = []
+    compos_rec = []
+    compos_nonrec = []
+    for label in seeded:
+        left, top, width, height = stats[label, :4]
+        # a connected region covers every row and column of its bounding box
+        if width <= 3 or height <= 3:
+            continue
+        rows, cols = np.nonzero(labels[top:top + height, left:left + width] == label)
+        region = np.stack((rows + top, cols + left), axis=1)
+        component = Component(region, binary.shape)
+
+        if test:
+            print('Area:%d' % (len(region)))
+            draw.draw_boundary([component], binary.shape, show=True)
+
+        compos_all.append(component)
+
+        if rec_detect:
+            # rectangle check
+            if component.compo_is_rectangle(min_rec_evenness, max_dent_ratio):
+                component.rect_ = True
+                compos_rec.append(component)
+            else:
+                component.rect_ = False
+                compos_nonrec.append(component)
+
+        if show:
+            print('Area:%d' % (len(region)))
+            draw.draw_boundary(compos_all, binary.shape, show=True)
+
+    if rec_detect:
+        return compos_rec, compos_nonrec
+    else:
+        return compos_all
+
+
 def nested_components_detection(grey, org, grad_thresh,
                    show=False, write_path=None,
                    step_h=10, step_v=10,
@@ -499,8 +622,8 @@ def nested_components_detection(grey, org, grad_thresh,
                 # ignore small regions
                 if ff[0] < 500: continue
                 mask_copy = mask - mask_copy
-                region = np.reshape(cv2.findNonZero(mask_copy[1:-1, 1:-1]), (-1, 2))
-                region = [(p[1], p[0]) for p in region]
+                # findNonZero gives (column, row) points
+                region = np.reshape(cv2.findNonZero(mask_copy[1:-1, 1:-1]), (-1, 2))[:, ::-1]
 
                 compo = Component(region, grey.shape)
                 # draw.draw_region(region, broad_all)
@@ -0,0 +1,96 @@
+import numpy as np
+
+'''
+Batched versions of the box relations of Element and Bbox, computed for many boxes at
+once. Boxes are arrays of (column_min, row_min, column_max, row_max) whose leading
+dimensions broadcast, e.g. a[:, None] and b[None, :] for every pair of a and b as an
+(n, m) matrix, or a[i] and a[j] for a list of pairs.
+Divisions by empty areas give inf/nan like the numpy scalars of the single pair methods
+'''
+
+
+# size of the (n, m) matrices computed at once, bigger batches are split by rows
+MAX_MATRIX_SIZE = 1 << 20
+
+
+def as_boxes(boxes):
+    boxes = np.asarray(boxes, dtype=np.int64)
+    return boxes.reshape(-1, 4) if boxes.ndim < 2 else boxes
+
+
+def split_pairs(pairs):
+    '''
+    :return: arrays of the first and second indexes of the list of pairs (i, j)
+    '''
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def row_batches(n, m):
+    '''
+    :return: slices of the n rows of an (n, m) matrix small enough to compute at once
+    '''
+    step = max(1, MAX_MATRIX_SIZE // max(1, m))
+    return [slice(start, start + step) for start in range(0, n, step)]
+
+
+def areas(boxes):
+    return (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+
+
+def element_overlaps(boxes_a, boxes_b, bias=(0, 0)):
+    '''
+    Element.calc_intersection_area: the bias only extends the start of the intersection
+    :return: inter, iou, ioa, iob
+    '''
+    a, b = as_boxes(boxes_a), as_boxes(boxes_b)
+    w = np.maximum(0, np.minimum(a[..., 2], b[..., 2]) - (np.maximum(a[..., 0], b[..., 0]) - bias[0]))
+    h = np.maximum(0, np.minimum(a[..., 3], b[..., 3]) - (np.maximum(a[..., 1], b[..., 1]) - bias[1]))
+    inter = w * h
+    area_a, area_b = areas(a), areas(b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = inter / (area_a + area_b - inter)
+        ioa = inter / area_a
+        iob = inter / area_b
+    return inter, iou, ioa, iob
+
+
+def element_relations(boxes_a, boxes_b, bias=(0, 0)):
+    '''
+    Element.element_relation
+    :return: -1 : a in b
+             0  : a, b are not intersected
+             1  : b in a
+             2  : a, b are identical or intersected
+    '''
+    inter, iou, ioa, iob = element_overlaps(boxes_a, boxes_b, bias)
+    return np.select([ioa == 0, ioa >= 1, iob >= 1], [0, -1, 1], default=2)
+
+
+def bbox_relations(boxes_a, boxes_b):
+    '''
+    Bbox.bbox_relation, containment being strict on every side
+    '''
+    a, b = as_boxes(boxes_a), as_boxes(boxes_b)
+    a_in_b = (a[..., 0] > b[..., 0]) & (a[..., 1] > b[..., 1]) & (a[..., 2] < b[..., 2]) & (a[..., 3] < b[..., 3])
+    b_in_a = (a[..., 0] < b[..., 0]) & (a[..., 1] < b[..., 1]) & (a[..., 2] > b[..., 2]) & (a[..., 3] > b[..., 3])
+    apart = (a[..., 0] > b[..., 2]) | (a[..., 1] > b[..., 3]) | (b[..., 0] > a[..., 2]) | (b[..., 1] > a[..., 3])
+    return np.select([a_in_b, b_in_a, apart], [-1, 1, 0], default=2)
+
+
+def bbox_relations_nms(boxes_a, boxes_b, bias=(0, 0)):
+    '''
+    Bbox.bbox_relation_nms: the bias extends both boxes on every side
+    '''
+    a, b = as_boxes(boxes_a), as_boxes(boxes_b)
+    w = np.maximum(0, np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]) + 2 * bias[0])
+    h = np.maximum(0, np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]) + 2 * bias[1])
+    inter = w * h
+    area_a, area_b = areas(a), areas(b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = inter / (area_a + area_b - inter)
+        ioa = inter / area_a
+        iob = inter / area_b
+    not_intersected = (iou == 0) & (ioa == 0) & (iob == 0)
+    intersected = (iou >= 0.02) | (iob > 0.2) | (ioa > 0.2)
+    return np.select([not_intersected, ioa >= 1, iob >= 1, intersected], [0, -1, 1, 2], default=0)
@@ -0,0 +1,74 @@
+import cv2
+import numpy as np
+
+'''
+Sums over rectangles of an image from its summed-area table, built once per frame and
+shared by the passes looking at the pixels of many compos, instead of each of them
+clipping and summing the pixels again.
+Rectangles are (column_min, row_min, column_max, row_max) with the max excluded, like
+the slice img[row_min:row_max, column_min:column_max]
+'''
+
+
+class RegionStats:
+    def __init__(self, img):
+        '''
+        :param img: single channel image, e.g. the binary map
+        '''
+        self.shape = img.shape[:2]
+        # float64 sums are exact up to 2^53, int32 would overflow on large binary maps
+        self.integral = cv2.integral(img, sdepth=cv2.CV_64F)
+
+    def clamp(self, col_min, row_min, col_max, row_max):
+        height, width = self.shape
+        return (np.clip(col_min, 0, width), np.clip(row_min, 0, height),
+                np.clip(col_max, 0, width), np.clip(row_max, 0, height))
+
+    def sums(self, col_min, row_min, col_max, row_max):
+        '''
+        Sum of the pixels of each rectangle, the bounds being arrays of any shapes that broadcast
+        '''
+        col_min, row_min, col_max, row_max = self.clamp(col_min, row_min, col_max, row_max)
+        col_max, row_max = np.maximum(col_max, col_min), np.maximum(row_max, row_min)
+        integral = self.integral
+        return integral[row_max, col_max] - integral[row_min, col_max] - \
+            integral[row_max, col_min] + integral[row_min, col_min]
+
+    def row_sums(self, col_min, row_min, col_max, row_max):
+        '''
+        Sum of each row of the rectangle, from row_min
+        '''
+        col_min, row_min, col_max, row_max = self.clamp(col_min, row_min, col_max, row_max)
+        rows = np.arange(row_min, max(row_min, row_max))
+        return self.sums(col_min, rows, col_max, rows + 1)
+
+    def column_sums(self, col_min, row_min, col_max, row_max):
+        '''
+        Sum of each column of the rectangle, from col_min
+        '''
+        col_min, row_min, col_max, row_max = self.clamp(col_min, row_min, col_max, row_max)
+        cols = np.arange(col_min, max(col_min, col_max))
+        return self.sums(cols, row_min, cols + 1, row_max)
+
+
+def histogram(img, slices, channel=None, bins=256):
+    '''
+    Histogram of the pixels of several parts of an image, counting the pixels of
+    overlapping parts once for each part, without copying them into one array first
+    :param slices: list of (row_slice, column_slice)
+    :param channel: channel of a color image to count
+    '''
+    counts = np.zeros(bins, dtype=np.int64)
+    for rows, cols in slices:
+        part = img[rows, cols] if channel is None else img[rows, cols, channel]
+        if part.size > 0:
+            counts += np.bincount(part.ravel(), minlength=bins)[:bins]
+    return counts
+
+
+def most_common_color(img, slices):
+    '''
+    :return: most common value of each channel among the pixels of the parts, the
+             smallest one on a tie, 0 when the parts are empty
+    '''
+    return [int(np.argmax(histogram(img, slices, channel))) for channel in range(img.shape[2])]
@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from detect_compo.lib_ip.Component import Component
+from config.CONFIG_UIED import Config
+C = Config()
+
+'''
+Nested component detection without flood filling.
+cv2.floodFill with a floating range fills a neighbour when its grey level is within
+grad_thresh of the filled pixel next to it, so each fill is a connected component of the
+graph linking the 4-neighbours within grad_thresh of each other. The graph is drawn once
+for the whole image as a map twice its size, pixels on the even rows and columns and
+links between them, and the regions of any clip are the connected components of the
+matching part of the map
+'''
+
+# big compos inspected at the same time, labelling runs outside of the GIL
+NESTING_WORKERS = 4
+
+
+def connection_map(grey, grad_thresh):
+    '''
+    :return: (2 * height - 1, 2 * width - 1) uint8 map, pixel [i, j] at [2i, 2j], 1 between
+             two neighbours within grad_thresh of each other
+    '''
+    grey = grey.astype(np.int16)
+    height, width = grey.shape
+    connections = np.zeros((2 * height - 1, 2 * width - 1), dtype=np.uint8)
+    connections[::2, ::2] = 1
+    connections[::2, 1::2] = np.abs(np.diff(grey, axis=1)) <= grad_thresh
+    connections[1::2, ::2] = np.abs(np.diff(grey, axis=0)) <= grad_thresh
+    return connections
+
+
+def clip_regions(connections, bbox):
+    '''
+    Label the regions of the clip img[row_min:row_max, column_min:column_max], the same
+    clip as Component.compo_clipping
+    :return: labels of the clip pixels, area of each label
+    '''
+    column_min, row_min, column_max, row_max = bbox
+    clip = np.ascontiguousarray(connections[2 * row_min:2 * row_max - 1, 2 * column_min:2 * column_max - 1])
+    count, labels = cv2.connectedComponents(clip, connectivity=4)
+    labels = np.ascontiguousarray(labels[::2, ::2])
+    return labels, np.bincount(labels.ravel(), minlength=count)
+
+
+def nested_components_detection_cc(connections, bbox,
+                                   step_h=10, step_v=10,
+                                   line_thickness=C.THRESHOLD_LINE_THICKNESS,
+                                   min_rec_evenness=C.THRESHOLD_REC_MIN_EVENNESS,
+                                   max_dent_ratio=C.THRESHOLD_REC_MAX_DENT_RATIO):
+    '''
+    Same result as ip_detection.nested_components_detection on the grey clip of bbox,
+    positions relative to the clip
+    '''
+    # clamped like Component.compo_clipping
+    column_min, row_min, column_max, row_max = bbox
+    bbox = (max(column_min, 0), max(row_min, 0),
+            min(column_max, (connections.shape[1] + 1) // 2), min(row_max, (connections.shape[0] + 1) // 2))
+    if bbox[2] <= bbox[0] or bbox[3] <= bbox[1]:
+        return []
+    labels, areas = clip_regions(connections, bbox)
+    row, column = labels.shape
+
+    # like component_detection_cc, keep the regions in the order the flood fill finds
+    # them, seeds being skipped when the region up-left of them was already filled and
+    # on the first row and column after the first fill
+    border = -1
+    seed_rows, seed_columns = np.meshgrid(np.arange(0, row, step_h), np.arange(0, column, step_v), indexing='ij')
+    seed_rows, seed_columns = seed_rows.ravel(), seed_columns.ravel()
+    seed_labels = labels[seed_rows, seed_columns]
+    diagonal_labels = np.full(len(seed_labels), border, dtype=labels.dtype)
+    inner = (seed_rows > 0) & (seed_columns > 0)
+    diagonal_labels[inner] = labels[seed_rows[inner] - 1, seed_columns[inner] - 1]
+
+    found = set()
+    filled = []
+    for label, diagonal in zip(seed_labels.tolist(), diagonal_labels.tolist()):
+        if label in found or diagonal in found:
+            continue
+        found.update((label, border))
+        filled.append(label)
+
+    # ignore small regions
+    filled = [label for label in filled if areas[label] >= 500]
+    if len(filled) == 0:
+        return []
+    # pixels of all the remaining regions in one pass, grouped by region in row-major order
+    kept = np.zeros(len(areas), dtype=bool)
+    kept[filled] = True
+    positions = np.flatnonzero(kept[labels.ravel()])
+    positions = positions[np.argsort(labels.ravel()[positions], kind='stable')]
+    starts = np.concatenate(([0], np.cumsum(areas[kept])))
+    group = {label: n for n, label in enumerate(np.flatnonzero(kept).tolist())}
+
+    compos = []
+    for label in filled:
+        n = group[label]
+        rows, cols = np.divmod(positions[starts[n]:starts[n + 1]], column)
+        # a connected region covers every row and column of its bounding box
+        height, width = rows[-1] - rows[0] + 1, cols.max() - cols.min() + 1
+        if height < 30 or width * height / (row * column) > 0.9:
+            continue
+        compo = Component(np.stack((rows, cols), axis=1), labels.shape)
+        if compo.area / (row * column) > 0.7:
+            compo.redundant = True
+        # ignore lines
+        if compo.compo_is_line(line_thickness):
+            continue
+        # ignore non-rectangle as blocks must be rectangular
+        if not compo.compo_is_rectangle(min_rec_evenness, max_dent_ratio):
+            continue
+        compos.append(compo)
+    return compos
+
+
+def nested_components_of_compos(grey, compos, grad_thresh, workers=NESTING_WORKERS):
+    '''
+    :return: for each compo, the compos nested in it relative to the clip
+    '''
+    if len(compos) == 0:
+        return []
+    connections = connection_map(grey, grad_thresh)
+    bboxes = [compo.put_bbox() for compo in compos]
+    if workers <= 1 or len(compos) == 1:
+        return [nested_components_detection_cc(connections, bbox) for bbox in bboxes]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda bbox: nested_components_detection_cc(connections, bbox), bboxes))
@@ -30,6 +30,17 @@ def read_img(path, resize_height=None, kernel_size=None):
         return None, None
 
 
+def read_frame(frame, resize_height=None, kernel_size=None):
+    '''
+    Same as read_img, but takes the in-memory Frame instead of reading a file
+    '''
+    img = frame.pixels if resize_height is None else frame.resized(resize_height)
+    if kernel_size is not None:
+        img = cv2.medianBlur(img, kernel_size)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img, gray
+
+
 def gray_to_gradient(img):
     if len(img.shape) == 3:
         img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -0,0 +1,181 @@
+import numpy as np
+
+'''
+Spatial queries over bounding boxes (column_min, row_min, column_max, row_max), to only
+compare the boxes that are close to each other instead of every pair.
+Two boxes a and b "intersect" with a bias when
+    max(a.min, b.min) - bias < min(a.max, b.max)
+on both axes (so a box empty once biased intersects nothing), the same test Element.calc_intersection_area and Bbox.bbox_relation_nms
+use to get a positive intersection area, so every relation other than "not intersected"
+is among the pairs returned here
+'''
+
+
+def extents(boxes, bias=(0, 0)):
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    low = boxes[:, :2] - np.asarray(bias, dtype=np.int64)
+    high = boxes[:, 2:]
+    return low, high
+
+
+def intersected_pairs(boxes, bias=(0, 0)):
+    '''
+    Sort and sweep along the columns
+    :return: list of (i, j), i < j, of the intersected boxes, sorted by i then j
+    '''
+    low, high = extents(boxes, bias)
+    if len(low) < 2:
+        return []
+    order = np.argsort(low[:, 0], kind='stable')
+    low, high = low[order], high[order]
+    non_empty = (low < high).all(axis=1)
+    # boxes starting before this one ends on the columns
+    ends = np.searchsorted(low[:, 0], high[:, 0], side='left')
+
+    firsts, seconds = [], []
+    for k in range(len(order) - 1):
+        if not non_empty[k] or ends[k] <= k + 1:
+            continue
+        others = np.arange(k + 1, ends[k])
+        hit = non_empty[others] & (low[others, 1] < high[k, 1]) & (low[k, 1] < high[others, 1]) & \
+              (low[others, 0] < high[k, 0]) & (low[k, 0] < high[others, 0])
+        others = others[hit]
+        firsts.append(np.full(len(others), order[k]))
+        seconds.append(order[others])
+    if len(firsts) == 0:
+        return []
+
+    firsts, seconds = np.concatenate(firsts), np.concatenate(seconds)
+    i, j = np.minimum(firsts, seconds), np.maximum(firsts, seconds)
+    sort = np.lexsort((j, i))
+    return list(zip(i[sort].tolist(), j[sort].tolist()))
+
+
+class GridIndex:
+    '''
+    Uniform grid of boxes that can be inserted, moved and removed, for the passes
+    growing boxes as they merge them. Boxes spanning more than max_cells cells are
+    kept aside and checked on every query instead, so a box growing over the whole
+    screen doesn't cost a visit to every cell each time it moves
+    '''
+
+    def __init__(self, bias=(0, 0), cell_size=64, max_cells=64):
+        self.bias = bias
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.extents = {}
+        self.cells = {}
+        self.large = set()
+
+    def extent(self, box):
+        col_min, row_min, col_max, row_max = box
+        return col_min - self.bias[0], row_min - self.bias[1], col_max, row_max
+
+    def cell_range(self, extent):
+        col_low, row_low, col_high, row_high = (int(v) // self.cell_size for v in extent)
+        return range(row_low, row_high + 1), range(col_low, col_high + 1)
+
+    def insert(self, key, box):
+        extent = self.extent(box)
+        self.extents[key] = extent
+        rows, cols = self.cell_range(extent)
+        if len(rows) * len(cols) > self.max_cells:
+            self.large.add(key)
+            return
+        for row in rows:
+            for col in cols:
+                self.cells.setdefault((row, col), set()).add(key)
+
+    def remove(self, key):
+        extent = self.extents.pop(key)
+        if key in self.large:
+            self.large.discard(key)
+            return
+        rows, cols = self.cell_range(extent)
+        for row in rows:
+            for col in cols:
+                self.cells[(row, col)].discard(key)
+
+    def update(self, key, box):
+        self.remove(key)
+        self.insert(key, box)
+
+    def query(self, box):
+        '''
+        :return: sorted keys of the boxes intersecting this one
+        '''
+        extent = self.extent(box)
+        rows, cols = self.cell_range(extent)
+        if len(rows) * len(cols) > len(self.extents):
+            # cheaper to check every box
+            candidates = self.extents.keys()
+        else:
+            candidates = set(self.large)
+            for row in rows:
+                for col in cols:
+                    candidates.update(self.cells.get((row, col), ()))
+        return sorted(key for key in candidates if self.intersects(extent, self.extents[key]))
+
+    @staticmethod
+    def intersects(a, b):
+        return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3] and \
+            a[0] < a[2] and a[1] < a[3] and b[0] < b[2] and b[1] < b[3]
+
+
+def intersected_groups(boxes, bias=(0, 0)):
+    '''
+    Union-find over the intersected pairs, then again over the bounding boxes of the
+    groups until none of them intersect, as merging boxes grows them into new neighbours.
+    Boxes of different groups can't ever intersect, however the boxes of a group end
+    up being merged, so each group can be merged on its own
+    :return: list of groups, each a sorted list of indexes, sorted by first index
+    '''
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    parent = list(range(len(boxes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    roots = list(range(len(boxes)))
+    group_boxes = boxes
+    while True:
+        joined = False
+        for a, b in intersected_pairs(group_boxes, bias):
+            root_a, root_b = find(roots[a]), find(roots[b])
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+                joined = True
+        if not joined:
+            break
+        # bounding box of each group for the next round
+        members = {}
+        for i in range(len(boxes)):
+            members.setdefault(find(i), []).append(i)
+        roots = sorted(members)
+        group_boxes = np.array([
+            np.concatenate((boxes[members[root], :2].min(axis=0), boxes[members[root], 2:].max(axis=0)))
+            for root in roots
+        ]).reshape(-1, 4)
+
+    groups = {}
+    for i in range(len(boxes)):
+        groups.setdefault(find(i), []).append(i)
+    return sorted(groups.values())
+
+
+def merge_by_group(items, boxes, bias, merge):
+    '''
+    Runs merge, a "loop until nothing changes" pass returning the items left after
+    merging, on each group of intersected_groups instead of on all the items at once.
+    Gives the same items in the same order as merge(items) as long as merge only
+    merges items intersecting with this bias
+    '''
+    position = {id(item): i for i, item in enumerate(items)}
+    merged = []
+    for group in intersected_groups(boxes, bias):
+        group_items = [items[i] for i in group]
+        merged += group_items if len(group_items) == 1 else merge(group_items)
+    return sorted(merged, key=lambda item: position[id(item)])
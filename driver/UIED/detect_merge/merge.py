@@ -8,6 +8,9 @@ import time
 import shutil
 
 from detect_merge.Element import Element
+import detect_compo.lib_ip.ip_geometry as geometry
+from detect_compo.lib_ip.ip_integral import most_common_color
+import detect_compo.lib_ip.ip_spatial as spatial
 from utils import show_image
 
 
@@ -37,13 +40,18 @@ class DetectElementsResponse(TypedDict):
     img_shape: Tuple[int, int, int]
 
 
-def save_elements(output_file, elements, img_shape) -> DetectElementsResponse:
-    components: DetectElementsResponse = {"compos": [], "img_shape": img_shape}
+def elements_json(elements, img_shape):
+    components = {"compos": [], "img_shape": img_shape}
     for i, ele in enumerate(elements):
         c = ele.wrap_info()
         # c['id'] = i
         components["compos"].append(c)
-    json.dump(components, open(output_file, "w"), indent=4)
+    return components
+
+
+def save_elements(output_file, elements, img_shape) -> DetectElementsResponse:
+    with open(output_file, "w") as f:
+        json.dump(elements_json(elements, img_shape), f, indent=4)
 
     return {
         "compos": elements,
@@ -51,6 +59,39 @@ def save_elements(output_file, elements, img_shape) -> DetectElementsResponse:
     }
 
 
+def element_boxes(elements):
+    """
+    Ids, boxes, categories, texts and relations of the elements as they are now, to
+    draw or dump them later
+    """
+    return [
+        (
+            ele.id,
+            ele.put_bbox(),
+            ele.category,
+            ele.text_content,
+            [child.id for child in ele.children],
+            ele.parent_id,
+        )
+        for ele in elements
+    ]
+
+
+def elements_from_boxes(boxes):
+    """
+    The elements of element_boxes back, their ids being their indices after
+    reassign_ids
+    """
+    elements = [
+        Element(id, bbox, category, text_content=text_content)
+        for id, bbox, category, text_content, _, _ in boxes
+    ]
+    for element, (_, _, _, _, children, parent_id) in zip(elements, boxes):
+        element.children = [elements[child] for child in children]
+        element.parent_id = parent_id
+    return elements
+
+
 def reassign_ids(elements):
     for i, element in enumerate(elements):
         element.id = i
@@ -74,25 +115,40 @@ def merge_text_line_to_paragraph(elements, max_line_gap=5):
         else:
             non_texts.append(ele)
 
+    bias = (0, max_line_gap)
+    # only texts intersecting with the line gap merge, the ones too far apart to ever
+    # meet are merged separately
+    texts = spatial.merge_by_group(
+        texts,
+        [text.put_bbox() for text in texts],
+        bias,
+        lambda group: merge_text_lines_in_group(group, bias),
+    )
+    return non_texts + texts
+
+
+def merge_text_lines_in_group(texts, bias):
     changed = True
     while changed:
         changed = False
         temp_set = []
+        index = spatial.GridIndex(bias=bias)
         for text_a in texts:
             merged = False
-            for text_b in temp_set:
-                inter_area, _, _, _ = text_a.calc_intersection_area(
-                    text_b, bias=(0, max_line_gap)
-                )
-                if inter_area > 0:
-                    text_b.element_merge(text_a)
-                    merged = True
-                    changed = True
-                    break
+            # the index only returns the texts with a positive intersection area, in
+            # temp_set order, so text_a merges into the first one like before
+            for k in index.query(text_a.put_bbox()):
+                text_b = temp_set[k]
+                text_b.element_merge(text_a)
+                index.update(k, text_b.put_bbox())
+                merged = True
+                changed = True
+                break
             if not merged:
+                index.insert(len(temp_set), text_a.put_bbox())
                 temp_set.append(text_a)
         texts = temp_set.copy()
-    return non_texts + texts
+    return texts
 
 
 def refine_elements(compos, texts, intersection_bias=(2, 2), containment_ratio=0.8):
@@ -102,46 +158,55 @@ def refine_elements(compos, texts, intersection_bias=(2, 2), containment_ratio=0
     3. store text in a compo if it's contained by the compo as the compo's text child element
     """
     elements = []
-    contained_texts = []
-    for compo in compos:
-        is_valid = True
-        text_area = 0
-        for text in texts:
-            inter, iou, ioa, iob = compo.calc_intersection_area(
-                text, bias=intersection_bias
-            )
-            if inter > 0:
-                # the non-text is contained in the text compo
-                if ioa >= containment_ratio:
-                    is_valid = False
-                    break
-                text_area += inter
-                # the text is contained in the non-text compo
-                if iob >= containment_ratio and compo.category != "Block":
-                    contained_texts.append(text)
-        if is_valid and text_area / compo.area < containment_ratio:
-            # for t in contained_texts:
-            #     t.parent_id = compo.id
-            # compo.children += contained_texts
-            elements.append(compo)
+    contained = np.zeros(len(texts), dtype=bool)
+    compo_boxes = geometry.as_boxes([compo.put_bbox() for compo in compos])
+    text_boxes = geometry.as_boxes([text.put_bbox() for text in texts])
+    not_block = np.array([compo.category != "Block" for compo in compos], dtype=bool)
+    order = np.arange(len(texts))
+    for rows in geometry.row_batches(len(compos), len(texts)):
+        inter, iou, ioa, iob = geometry.element_overlaps(
+            compo_boxes[rows, None], text_boxes[None], bias=intersection_bias
+        )
+        hit = inter > 0
+        # the non-text is contained in the text compo, the texts after the first
+        # such one are not looked at
+        inside = hit & (ioa >= containment_ratio)
+        first_inside = np.where(inside, order, len(texts)).min(axis=1, initial=len(texts))
+        hit &= order < first_inside[:, None]
+        # the text is contained in the non-text compo
+        contained |= (hit & (iob >= containment_ratio) & not_block[rows, None]).any(
+            axis=0
+        )
+        for k, compo in enumerate(compos[rows]):
+            if first_inside[k] < len(texts):
+                continue
+            text_area = inter[k][hit[k]].sum() if hit[k].any() else 0
+            if text_area / compo.area < containment_ratio:
+                # for t in contained_texts:
+                #     t.parent_id = compo.id
+                # compo.children += contained_texts
+                elements.append(compo)
 
     # elements += texts
-    for text in texts:
-        if text not in contained_texts:
+    for text, is_contained in zip(texts, contained):
+        if not is_contained:
             elements.append(text)
     return elements
 
 
 def check_containment(elements):
-    for i in range(len(elements) - 1):
-        for j in range(i + 1, len(elements)):
-            relation = elements[i].element_relation(elements[j], bias=(2, 2))
-            if relation == -1:
-                elements[j].children.append(elements[i])
-                elements[i].parent_id = elements[j].id
-            if relation == 1:
-                elements[i].children.append(elements[j])
-                elements[j].parent_id = elements[i].id
+    bias = (2, 2)
+    # only intersected elements can contain one another
+    boxes = geometry.as_boxes([element.put_bbox() for element in elements])
+    firsts, seconds = geometry.split_pairs(spatial.intersected_pairs(boxes, bias))
+    relations = geometry.element_relations(boxes[firsts], boxes[seconds], bias=bias)
+    for i, j, relation in zip(firsts.tolist(), seconds.tolist(), relations.tolist()):
+        if relation == -1:
+            elements[j].children.append(elements[i])
+            elements[i].parent_id = elements[j].id
+        if relation == 1:
+            elements[i].children.append(elements[j])
+            elements[j].parent_id = elements[i].id
 
 
 def remove_top_bar(elements, img_height):
@@ -173,18 +238,16 @@ def compos_clip_and_fill(clip_root, org, compos):
         left = col_min - pad if col_min - pad >= 0 else 0
         bottom = row_max + pad if row_max + pad < org.shape[0] - 1 else org.shape[0] - 1
         right = col_max + pad if col_max + pad < org.shape[1] - 1 else org.shape[1] - 1
-        most = []
-        for i in range(3):
-            val = np.concatenate(
-                (
-                    org[up : row_min - offset, left:right, i].flatten(),
-                    org[row_max + offset : bottom, left:right, i].flatten(),
-                    org[up:bottom, left : col_min - offset, i].flatten(),
-                    org[up:bottom, col_max + offset : right, i].flatten(),
-                )
-            )
-            most.append(int(np.argmax(np.bincount(val))))
-        return most
+        # the same strips as slicing org, corners being counted twice
+        return most_common_color(
+            org,
+            [
+                (slice(up, row_min - offset), slice(left, right)),
+                (slice(row_max + offset, bottom), slice(left, right)),
+                (slice(up, bottom), slice(left, col_min - offset)),
+                (slice(up, bottom), slice(col_max + offset, right)),
+            ],
+        )
 
     if os.path.exists(clip_root):
         shutil.rmtree(clip_root)
@@ -220,7 +283,7 @@ def compos_clip_and_fill(clip_root, org, compos):
 
 
 def merge(
-    img_path,
+    frame,
     compo_json,
     text_json,
     merge_root=None,
@@ -228,7 +291,14 @@ def merge(
     is_remove_bar=True,
     show=False,
     wait_key=0,
+    artifacts=None,
 ) -> Tuple[Any, DetectElementsResponse]:
+    """
+    :param artifacts: driver.artifacts.ArtifactSink the board and json of the merged
+                      elements are written to, nothing is written without it
+    :return: the board of the merged elements, None when it was not shown, and the
+             merged elements
+    """
     # load text and non-text compo
     ele_id = 0
     compos = []
@@ -260,18 +330,7 @@ def merge(
         for text in texts:
             text.resize(resize_ratio)
 
-    # check the original detected elements
-    img = cv2.imread(img_path)
-    img_resize = cv2.resize(
-        img, (compo_json["img_shape"][1], compo_json["img_shape"][0])
-    )
-    show_elements(
-        img_resize,
-        texts + compos,
-        show=False,
-        win_name="all elements before merging",
-        wait_key=wait_key,
-    )
+    img_resize = frame.resized(compo_json["img_shape"][0])
 
     # refine elements
     texts = refine_texts(texts, compo_json["img_shape"])
@@ -283,18 +342,33 @@ def merge(
         elements = merge_text_line_to_paragraph(elements, max_line_gap=7)
     reassign_ids(elements)
     check_containment(elements)
-    board = show_elements(
-        img_resize,
-        elements,
-        show=show,
-        win_name="elements after merging",
-        wait_key=wait_key,
-    )
+    board = None
+    if show:
+        board = show_elements(
+            img_resize,
+            elements,
+            show=show,
+            win_name="elements after merging",
+            wait_key=wait_key,
+        )
 
     # save all merged elements, clips and blank background
-    name = img_path.replace("\\", "/").split("/")[-1][:-4]
-    components = save_elements(
-        pjoin(merge_root, name + ".json"), elements, img_resize.shape
-    )
-    cv2.imwrite(pjoin(merge_root, name + ".jpg"), board)
+    name = frame.name
+    if artifacts is not None and artifacts.enabled:
+        # the elements are moved around by the caller afterwards (see perception), so
+        # only their boxes are taken now, drawn and dumped if the artifacts are written
+        boxes = element_boxes(elements)
+        img_shape = img_resize.shape
+        artifacts.json(
+            pjoin(merge_root, name + ".json"),
+            lambda: elements_json(elements_from_boxes(boxes), img_shape),
+        )
+        artifacts.image(
+            pjoin(merge_root, name + ".jpg"),
+            lambda: show_elements(img_resize, elements_from_boxes(boxes)),
+        )
+    components: DetectElementsResponse = {
+        "compos": elements,
+        "img_shape": img_resize.shape,
+    }
     return board, components
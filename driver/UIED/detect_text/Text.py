@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
 
+from detect_compo.lib_ip.ip_integral import RegionStats
+
 
 class Text:
     def __init__(self, id, content, location):
@@ -104,63 +106,20 @@ class Text:
         self.content = left_element.content + ' ' + right_element.content
         self.word_width = self.width / len(self.content)
 
-    def shrink_bound(self, binary_map):
-        bin_clip = binary_map[self.location['top']:self.location['bottom'], self.location['left']:self.location['right']]
-        height, width = np.shape(bin_clip)
-
-        shrink_top = 0
-        shrink_bottom = 0
-        for i in range(height):
-            # top
-            if shrink_top == 0:
-                if sum(bin_clip[i]) == 0:
-                    shrink_top = 1
-                else:
-                    shrink_top = -1
-            elif shrink_top == 1:
-                if sum(bin_clip[i]) != 0:
-                    self.location['top'] += i
-                    shrink_top = -1
-            # bottom
-            if shrink_bottom == 0:
-                if sum(bin_clip[height-i-1]) == 0:
-                    shrink_bottom = 1
-                else:
-                    shrink_bottom = -1
-            elif shrink_bottom == 1:
-                if sum(bin_clip[height-i-1]) != 0:
-                    self.location['bottom'] -= i
-                    shrink_bottom = -1
-
-            if shrink_top == -1 and shrink_bottom == -1:
-                break
-
-        shrink_left = 0
-        shrink_right = 0
-        for j in range(width):
-            # left
-            if shrink_left == 0:
-                if sum(bin_clip[:, j]) == 0:
-                    shrink_left = 1
-                else:
-                    shrink_left = -1
-            elif shrink_left == 1:
-                if sum(bin_clip[:, j]) != 0:
-                    self.location['left'] += j
-                    shrink_left = -1
-            # right
-            if shrink_right == 0:
-                if sum(bin_clip[:, width-j-1]) == 0:
-                    shrink_right = 1
-                else:
-                    shrink_right = -1
-            elif shrink_right == 1:
-                if sum(bin_clip[:, width-j-1]) != 0:
-                    self.location['right'] -= j
-                    shrink_right = -1
-
-            if shrink_left == -1 and shrink_right == -1:
-                break
+    def shrink_bound(self, binary_map, stats=None):
+        '''
+        Remove the blank rows and columns around the text
+        :param stats: RegionStats of binary_map, if already built
+        '''
+        if stats is None:
+            stats = RegionStats(binary_map)
+        box = (self.location['left'], self.location['top'], self.location['right'], self.location['bottom'])
+        shrink_top, shrink_bottom = blank_margins(stats.row_sums(*box) != 0)
+        shrink_left, shrink_right = blank_margins(stats.column_sums(*box) != 0)
+        self.location['top'] += shrink_top
+        self.location['bottom'] -= shrink_bottom
+        self.location['left'] += shrink_left
+        self.location['right'] -= shrink_right
         self.width = self.location['right'] - self.location['left']
         self.height = self.location['bottom'] - self.location['top']
         self.area = self.width * self.height
@@ -179,3 +138,14 @@ class Text:
             cv2.imshow('text', img)
             cv2.waitKey()
             cv2.destroyWindow('text')
+
+
+def blank_margins(filled):
+    '''
+    :param filled: bool array, True for the non-blank lines
+    :return: number of blank lines at the start and at the end, 0 if all are blank
+    '''
+    lines = np.flatnonzero(filled)
+    if len(lines) == 0:
+        return 0, 0
+    return int(lines[0]), int(len(filled) - 1 - lines[-1])
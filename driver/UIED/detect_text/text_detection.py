@@ -1,18 +1,19 @@
 import detect_text.ocr as ocr
+import detect_compo.lib_ip.ip_spatial as spatial
 from detect_text.Text import Text
 import numpy as np
 import cv2
 import json
-import time
 import os
 from os.path import join as pjoin
 from utils import show_image
 
+from driver.frame import Frame
+from driver.trace import span
 from driver.types import AnnotatedImage
 
 
-def save_detection_json(file_path, texts, img_shape):
-    f_out = open(file_path, 'w')
+def detection_json(texts, img_shape):
     output = {'img_shape': img_shape, 'texts': []}
     for text in texts:
         c = {'id': text.id, 'content': text.content}
@@ -21,7 +22,13 @@ def save_detection_json(file_path, texts, img_shape):
         c['width'] = text.width
         c['height'] = text.height
         output['texts'].append(c)
-    json.dump(output, f_out, indent=4)
+    return output
+
+
+def save_detection_json(file_path, texts, img_shape):
+    output = detection_json(texts, img_shape)
+    with open(file_path, 'w') as f_out:
+        json.dump(output, f_out, indent=4)
 
     return output
 
@@ -39,12 +46,50 @@ def visualize_texts(org_img, texts, shown_resize_height=None, show=False, write_
         show_image("OCR", img_resize)
     if write_path is not None:
         cv2.imwrite(write_path, img)
+    return img
+
+
+def text_box(text):
+    loc = text.location
+    return loc['left'], loc['top'], loc['right'], loc['bottom']
 
 
 def text_sentences_recognition(texts):
     '''
     Merge separate words detected by Google ocr into a sentence
     '''
+    # Words merge when on the same line, less than 2 word widths apart, so only the
+    # words that close to each other are merged together. Merging can widen the word
+    # width a bit, so start with some slack and redo with more if it went over it
+    max_word_width = 1.5 * max((text.word_width for text in texts), default=0)
+    original = [(text, dict(text.__dict__, location=dict(text.location))) for text in texts]
+    while True:
+        widest = [0]
+
+        def merge_sentences(group):
+            group, word_width = merge_sentences_in_group(group)
+            widest[0] = max(widest[0], word_width)
+            return group
+
+        # on the same line means overlapping rows, close enough means less than 2 word widths apart
+        bias = (int(2 * max_word_width) + 1, 1)
+        merged = spatial.merge_by_group(texts, [text_box(text) for text in texts], bias, merge_sentences)
+        if widest[0] <= max_word_width:
+            break
+        for text, state in original:
+            text.__dict__.update(state)
+        max_word_width = widest[0] * 1.5
+
+    for i, text in enumerate(merged):
+        text.id = i
+    return merged
+
+
+def merge_sentences_in_group(texts):
+    '''
+    :return: the merged texts and the widest word width any merge got to
+    '''
+    widest = 0
     changed = True
     while changed:
         changed = False
@@ -54,22 +99,25 @@ def text_sentences_recognition(texts):
             for text_b in temp_set:
                 if text_a.is_on_same_line(text_b, 'h', bias_justify=0.2 * min(text_a.height, text_b.height), bias_gap=2 * max(text_a.word_width, text_b.word_width)):
                     text_b.merge_text(text_a)
+                    widest = max(widest, text_b.word_width)
                     merged = True
                     changed = True
                     break
             if not merged:
                 temp_set.append(text_a)
         texts = temp_set.copy()
-
-    for i, text in enumerate(texts):
-        text.id = i
-    return texts
+    return texts, widest
 
 
 def merge_intersected_texts(texts):
     '''
     Merge intersected texts (sentences or words)
     '''
+    # is_intersected adds its bias of 2 to the intersection start, the opposite of ip_spatial
+    return spatial.merge_by_group(texts, [text_box(text) for text in texts], (-2, -2), merge_intersected_texts_in_group)
+
+
+def merge_intersected_texts_in_group(texts):
     changed = True
     while changed:
         changed = False
@@ -130,25 +178,29 @@ def text_filter_noise(texts):
     return valid_texts
 
 
-def text_detection(ocr_result: AnnotatedImage, input_file='../data/input/30800.jpg', output_file='../data/output', show=False):
+def text_detection(ocr_result: AnnotatedImage, frame: Frame, output_file='../data/output', show=False, artifacts=None):
     '''
-    :param method: google or paddle
-    :param paddle_model: the preload paddle model for paddle ocr
+    :param frame: the captured screen the ocr_result was computed on
+    :param artifacts: driver.artifacts.ArtifactSink the drawn texts and json are written to, nothing is written without it
     '''
-    start = time.time()
-    name = input_file.split('/')[-1][:-4]
+    name = frame.name
     ocr_root = pjoin(output_file, 'ocr')
-    img = cv2.imread(input_file)
+    img = frame.pixels
 
-    texts = text_cvt_orc_format(ocr_result)
-    # texts = merge_intersected_texts(texts)
-    texts = text_filter_noise(texts)
-    texts = text_sentences_recognition(texts)
+    with span('text_merge'):
+        texts = text_cvt_orc_format(ocr_result)
+        # texts = merge_intersected_texts(texts)
+        texts = text_filter_noise(texts)
+        texts = text_sentences_recognition(texts)
 
-    visualize_texts(img, texts, shown_resize_height=800, show=show, write_path=pjoin(ocr_root, name+'.png'))
-    json = save_detection_json(pjoin(ocr_root, name+'.json'), texts, img.shape)
+    if show:
+        visualize_texts(img, texts, shown_resize_height=800, show=show)
+    output = detection_json(texts, img.shape)
+    if artifacts is not None:
+        artifacts.image(pjoin(ocr_root, name+'.png'), lambda: visualize_texts(img, texts))
+        artifacts.json(pjoin(ocr_root, name+'.json'), lambda: output)
 
-    return json
+    return output
 
 
 # text_detection()
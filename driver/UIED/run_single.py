@@ -1,6 +1,7 @@
 import sys
 import os
-from typing import List, Tuple, TypedDict
+from concurrent.futures import Future
+from typing import List, Optional, Tuple, TypedDict, Union
 
 sys.path.append(os.path.dirname(__file__))
 sys.path.append(
@@ -11,16 +12,15 @@ from os.path import join as pjoin
 import cv2
 import numpy as np
 
-from detect_text.ocr import ocr_detection_google
-from google.cloud import vision
-
+from driver.artifacts import ArtifactSink
+from driver.frame import Frame
+from driver.trace import span
 from driver.types import AnnotatedImage
 from detect_merge.merge import DetectElementsResponse
 
 
-def resize_height_by_longest_edge(img_path, resize_length=800):
-    org = cv2.imread(img_path)
-    height, width = org.shape[:2]
+def resize_height_by_longest_edge(frame: Frame, resize_length=800):
+    height, width = frame.shape[:2]
     if height > width:
         return resize_length
     else:
@@ -85,30 +85,39 @@ key_params = {
 
 
 def detect_components(
-    input_path_img, ocr_result: AnnotatedImage, showOCR=False, showUIED=False
+    frame: Frame,
+    ocr_result: Union[AnnotatedImage, "Future[AnnotatedImage]"],
+    showOCR=False,
+    showUIED=False,
+    resized_height=None,
+    artifacts: Optional[ArtifactSink] = None,
 ) -> DetectElementsResponse:
+    """
+    ocr_result can also be a Future of a still running OCR request, in which case
+    the local component detection runs while waiting for it, and the two are only
+    joined at the text detection and merge stages that depend on the OCR
+
+    resized_height overrides the height the frame is resized to before detection,
+    used to keep crops of a screen at the same scale as the whole screen
+
+    the drawn elements and json of each stage are only written to ./output through
+    artifacts, following its policy, no file is written without it
+    """
     output_root = "output"
 
     # Resizes the image to be smaller because this process is heavy, and lower resolution
     # does not lose much quality when detecting components
     max_width_or_height = 982
-    resized_height = resize_height_by_longest_edge(
-        input_path_img, resize_length=max_width_or_height
-    )
+    if resized_height is None:
+        resized_height = resize_height_by_longest_edge(
+            frame, resize_length=max_width_or_height
+        )
     # color_tips()
 
     is_clf = False
 
-    import detect_text.text_detection as text
-
-    os.makedirs(pjoin(output_root, "ocr"), exist_ok=True)
-    text_json = text.text_detection(
-        ocr_result, input_path_img, output_root, show=showOCR
-    )
-
     import detect_compo.ip_region_proposal as ip
 
-    os.makedirs(pjoin(output_root, "ip"), exist_ok=True)
     # switch of the classification func
     classifier = None
     if is_clf:
@@ -119,35 +128,45 @@ def detect_components(
         classifier["Elements"] = CNN("Elements")
         # classifier['Noise'] = CNN('Noise')
     compo_json = ip.compo_detection(
-        input_path_img,
+        frame,
         output_root,
         key_params,
         classifier=classifier,
         resize_by_height=resized_height,
         show=False,
+        artifacts=artifacts,
     )
 
-    import detect_merge.merge as merge
+    import detect_text.text_detection as text
 
-    os.makedirs(pjoin(output_root, "merge"), exist_ok=True)
-    name = input_path_img.split("/")[-1][:-4]
-    compo_path = pjoin(output_root, "ip", str(name) + ".json")
-    ocr_path = pjoin(output_root, "ocr", str(name) + ".json")
-    board, components = merge.merge(
-        input_path_img,
-        compo_json,
-        text_json,
-        pjoin(output_root, "merge"),
-        is_remove_bar=key_params["remove-bar"],
-        is_paragraph=key_params["merge-line-to-paragraph"],
-        show=showUIED,
+    if isinstance(ocr_result, Future):
+        with span("ocr_wait"):
+            ocr_result = ocr_result.result()
+
+    text_json = text.text_detection(
+        ocr_result, frame, output_root, show=showOCR, artifacts=artifacts
     )
 
+    import detect_merge.merge as merge
+
+    with span("merge"):
+        board, components = merge.merge(
+            frame,
+            compo_json,
+            text_json,
+            pjoin(output_root, "merge"),
+            is_remove_bar=key_params["remove-bar"],
+            is_paragraph=key_params["merge-line-to-paragraph"],
+            show=showUIED,
+            artifacts=artifacts,
+        )
+
     return components
 
 
 if __name__ == "__main__":
     from dotenv import load_dotenv
+    from google.cloud import vision
 
     load_dotenv("../../.env")
 
@@ -158,16 +177,16 @@ if __name__ == "__main__":
         "api_key": os.environ.get("GCLOUD_VISION_API_KEY"),
     }
     client = vision.ImageAnnotatorClient(client_options=client_options)
-    with open(input_image_path, "rb") as image_file:
-        content = image_file.read()
+    frame = Frame.from_file(input_image_path)
 
-    image = vision.Image(content=content)
+    image = vision.Image(content=frame.encode(".png"))
     ocr_result = client.text_detection(image=image)  # type: ignore
 
     # ocr_result2 = ocr_detection_google("./twitter.png")
 
-    components = detect_components(
-        input_image_path, ocr_result, showOCR=True, showUIED=True
-    )
+    with ArtifactSink("always") as artifacts:
+        components = detect_components(
+            frame, ocr_result, showOCR=True, showUIED=True, artifacts=artifacts
+        )
 
     print("\n\ncomponents\n\n", components)
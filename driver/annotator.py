@@ -1,27 +1,53 @@
-import math
-import os
+import functools
+import time
+from typing import Optional
 from PIL import Image, ImageDraw, ImageFont
-import cv2
-from driver.UIED.run_single import detect_components
 from driver.UIED.utils import show_image
-from driver.ocr_call import ocr_text_detection
+from driver.artifacts import ArtifactSink, artifact_sink
+from driver.frame import Frame
+from driver.perception import PerceptionState, perceive, perceive_incremental
+from driver.trace import span, tracer
 
 
 from driver.types import DebugConfig, ImgMultiplierFactor, LabelMap
 from driver.utils import is_retina_display
 
 
-def annotate_image(input_image_path, debug: DebugConfig):
-    ocr_result = ocr_text_detection(input_image_path, debug)
-
-    components = detect_components(
-        input_image_path,
-        ocr_result,
-        showOCR=debug["ocr"],
-        showUIED=debug["uied"],
-    )
+def annotate_image(
+    frame: Frame,
+    debug: DebugConfig,
+    perception: Optional[PerceptionState] = None,
+    artifacts: Optional[ArtifactSink] = None,
+):
+    """
+    :param perception: state from the previous step, to only re-annotate the regions
+                       of the screen that changed since then
+    :param artifacts: sink of the step the debugging files are added to, see
+                      executor.run_step, or a sink of their own following
+                      debug["artifacts"] when None
+    """
+    if artifacts is not None:
+        return annotate(frame, debug, perception, artifacts)
+    with artifact_sink(debug) as artifacts:
+        return annotate(frame, debug, perception, artifacts)
+
+
+def annotate(
+    frame: Frame,
+    debug: DebugConfig,
+    perception: Optional[PerceptionState],
+    artifacts: ArtifactSink,
+):
+    with span("perception"):
+        if perception is not None:
+            components = perceive_incremental(
+                frame, debug, perception, artifacts=artifacts
+            )
+        else:
+            components = perceive(frame, debug, artifacts=artifacts)
 
-    original_image = Image.open(input_image_path)
+    annotation_start = time.perf_counter()
+    original_image = frame.to_pil()
     size = {"width": original_image.width, "height": original_image.height}
     img_multiplier_factor: ImgMultiplierFactor = {
         "height": components["img_shape"][0] / size["height"],
@@ -113,15 +139,15 @@ def annotate_image(input_image_path, debug: DebugConfig):
         }
         label_counter += 1
 
-    os.makedirs("./output/annotated", exist_ok=True)
-    output_image_path = f"./output/annotated/{os.path.basename(input_image_path)}"
-    original_image.save(output_image_path)
+    annotated = Frame.from_pil(original_image, name=frame.name)
+    artifacts.image(f"./output/annotated/{frame.name}.png", lambda: annotated.pixels)
+    tracer.record("annotation", annotation_start, time.perf_counter())
 
     print(f"{len(label_map.keys())} elements found on the screen", end="")
     if debug["annotations"]:
-        show_image("Annotated", cv2.imread(output_image_path))
+        show_image("Annotated", annotated.pixels)
 
-    return label_map, output_image_path, img_multiplier_factor
+    return label_map, annotated, img_multiplier_factor
 
 
 def draw_square(
@@ -135,11 +161,7 @@ def draw_square(
     outline_color="#EBD872",
 ):
     draw = ImageDraw.Draw(image)
-    font_size = round(height - 1)
-    try:
-        font = ImageFont.truetype("arialbd.ttf", font_size)
-    except Exception:
-        font = ImageFont.truetype("/Library/Fonts/Arial Bold.ttf", font_size)
+    font = label_font(round(height - 1))
     x, y = position
     x = max(0, x)
     y = max(0, y)
@@ -175,3 +197,17 @@ def draw_square(
         fill="black",
         font=font,
     )
+
+
+@functools.lru_cache(maxsize=None)
+def label_font(font_size: int):
+    """
+    Arial Bold where it is installed, DejaVu Sans Bold on most Linux boxes, Pillow's
+    own font otherwise, loaded once instead of for every label
+    """
+    for font in ["arialbd.ttf", "/Library/Fonts/Arial Bold.ttf", "DejaVuSans-Bold.ttf"]:
+        try:
+            return ImageFont.truetype(font, font_size)
+        except OSError:
+            pass
+    return ImageFont.load_default(size=font_size)
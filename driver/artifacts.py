@@ -0,0 +1,161 @@
+from collections import OrderedDict
+import atexit
+import itertools
+import json
+import os
+import threading
+from typing import Any, Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from driver.types import ArtifactPolicy, DebugConfig
+
+# steps seen by artifact_sink, to keep one in every few with the "sampled" policy
+steps_seen = itertools.count()
+
+
+class ArtifactWriter:
+    """
+    Draws, encodes and writes the artifacts on a background thread, so the agent loop
+    does not wait on them. The writes are queued by path, a write to a path already
+    queued replaces it (the screenshot name is the same every step, only the latest
+    files matter), and when the queue is full the oldest write is dropped.
+    Anything still queued is written when the process exits
+    """
+
+    def __init__(self, max_pending=16):
+        self.max_pending = max_pending
+        self.pending: OrderedDict[str, Callable[[], None]] = OrderedDict()
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.writing = False
+        self.dropped = 0
+
+    def submit(self, path: str, write: Callable[[], None]):
+        """
+        The writer takes ownership of what write draws or dumps, the caller must not
+        change it afterwards
+        """
+        with self.condition:
+            if path in self.pending:
+                del self.pending[path]
+            elif len(self.pending) >= self.max_pending:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+            self.pending[path] = write
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="artifacts", daemon=True
+                )
+                self.thread.start()
+            self.condition.notify_all()
+
+    def next_write(self) -> Tuple[str, Callable[[], None]]:
+        with self.condition:
+            while len(self.pending) == 0:
+                self.writing = False
+                self.condition.notify_all()
+                self.condition.wait()
+            self.writing = True
+            return self.pending.popitem(last=False)
+
+    def run(self):
+        while True:
+            path, write = self.next_write()
+            try:
+                write()
+            except Exception as error:
+                print(f"Could not write {path}: {error}")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits for everything queued to be written
+        :return: False if it was still writing after timeout seconds
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: len(self.pending) == 0 and not self.writing, timeout
+            )
+
+    def close(self):
+        self.flush()
+        if self.dropped > 0:
+            print(f"{self.dropped} artifacts were dropped, the steps went faster than they were written")
+
+
+artifact_writer = ArtifactWriter()
+atexit.register(artifact_writer.close)
+
+
+class ArtifactSink:
+    """
+    Debugging files of one step (OCR, UIED and annotated images, detection json) under
+    ./output, written or not depending on the policy:
+
+    off: nothing is written
+    always: every file is queued to the writer as soon as it is added
+    on-error: files are kept back and only written if the step raises, see __exit__
+
+    Files are added as callables drawing the image or building the json, only called
+    when the file is written, so nothing is drawn, encoded or dumped when it is not.
+    They are called on the writer's thread, see ArtifactWriter
+    """
+
+    def __init__(
+        self, policy: ArtifactPolicy = "off", writer: Optional[ArtifactWriter] = None
+    ):
+        self.policy = policy
+        self.writer = writer or artifact_writer
+        self.pending: List[Tuple[str, Callable[[], None]]] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.policy != "off"
+
+    def image(self, path: str, draw: Callable[[], np.ndarray]):
+        def write():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            cv2.imwrite(path, draw())
+
+        self.add(path, write)
+
+    def json(self, path: str, build: Callable[[], Any]):
+        def write():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(build(), f, indent=4)
+
+        self.add(path, write)
+
+    def add(self, path: str, write: Callable[[], None]):
+        if self.policy == "always":
+            self.writer.submit(path, write)
+        elif self.policy == "on-error":
+            self.pending.append((path, write))
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        for path, write in pending:
+            self.writer.submit(path, write)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.flush()
+        self.pending = []
+        return False
+
+
+def artifact_sink(debug: DebugConfig) -> ArtifactSink:
+    """
+    Sink for the files of a new step, the "sampled" policy writing all the files of
+    one step in every artifacts_every
+    """
+    policy = debug["artifacts"]
+    if policy == "sampled":
+        sampled = next(steps_seen) % max(1, debug["artifacts_every"]) == 0
+        policy = "always" if sampled else "off"
+    return ArtifactSink(policy)
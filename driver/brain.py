@@ -1,21 +1,34 @@
+import functools
 import json
 import re
+import time
 from typing import List, cast
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from openai.types.chat import (
     ChatCompletionMessageParam,
 )
 from driver.cost import log_cost
+from driver.frame import Frame
 from driver.logger import print_action
+from driver.session import current_session, without_images
+from driver.trace import tracer
 
 from driver.types import Action, Click, Context, Press, Refresh, Type
-from driver.utils import image_to_base64
 
-client = OpenAI()
 
+# created on first use, a replay never needs them (nor an API key)
+@functools.lru_cache(maxsize=None)
+def openai_client():
+    return OpenAI()
 
-def plan_next_step_actions(context: Context, image_path: str):
+
+@functools.lru_cache(maxsize=None)
+def async_openai_client():
+    return AsyncOpenAI()
+
+
+async def plan_next_step_actions(context: Context, image: Frame):
     print_action("Looking at the screen to plan next steps")
     print("Analyzing...")
 
@@ -58,7 +71,7 @@ def plan_next_step_actions(context: Context, image_path: str):
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": image_to_base64(image_path),
+                        "url": image.to_base64(),
                         "detail": "high",
                     },
                 },
@@ -84,18 +97,27 @@ def plan_next_step_actions(context: Context, image_path: str):
     model = "gpt-4-vision-preview"
     messages = system_message + history + user_message
 
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        stream=True,
-        max_tokens=600,
-    )
-
-    content = ""
-    for chunk in response:
-        if delta := chunk.choices[0].delta.content:
-            print(delta, end="", flush=True)
-            content += delta
+    async def request_plan() -> str:
+        llm_start = time.perf_counter()
+        response = await async_openai_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            max_tokens=600,
+        )
+
+        content = ""
+        async for chunk in response:
+            if delta := chunk.choices[0].delta.content:
+                if not content:
+                    tracer.record("llm_first_token", llm_start, time.perf_counter())
+                print(delta, end="", flush=True)
+                content += delta
+        tracer.record("llm_total", llm_start, time.perf_counter(), model=model)
+        return content
+
+    session = current_session()
+    content = await session.llm_async("plan", without_images(messages), request_plan)
 
     context["history"].append(
         {
@@ -110,16 +132,18 @@ def plan_next_step_actions(context: Context, image_path: str):
         }
     )
 
-    log_cost(
-        model=model,
-        messages=system_message + history,
-        completion=content,
-        image={
-            "text": user_prompt,
-            "path": image_path,
-            "detail": "high",
-        },
-    )
+    if not session.offline:
+        log_cost(
+            model=model,
+            messages=system_message + history,
+            completion=content,
+            image={
+                "text": user_prompt,
+                "width": image.width,
+                "height": image.height,
+                "detail": "high",
+            },
+        )
 
     return content
 
@@ -141,7 +165,9 @@ def extract_high_level_plan_and_actions(input: str):
 def extract_structured_actions(input: str):
     actions = heuristics_extract_structured_actions(input)
     if not actions:
-        actions = llm_structured_actions(input)
+        actions = current_session().llm(
+            "structured_actions", input, lambda: llm_structured_actions(input)
+        )
     return actions
 
 
@@ -214,7 +240,7 @@ def llm_structured_actions(input: str):
         },
     ]
 
-    response = client.chat.completions.create(
+    response = openai_client().chat.completions.create(
         model=model,
         messages=messages,
         tools=[
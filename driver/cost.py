@@ -5,14 +5,14 @@ from colorama import Fore, Style
 from openai.types.chat import (
     ChatCompletionMessageParam,
 )
-from PIL import Image
 
 total_cost: float = 0.0
 
 
 class ImageMessage(TypedDict):
     text: str
-    path: str
+    width: int
+    height: int
     detail: Literal["high", "low"]
 
 
@@ -32,11 +32,7 @@ def log_cost(
     )
 
     if image:
-        img = Image.open(image["path"])
-        width, height = img.size
-        img.close()
-
-        tokens = calculate_token_cost(width, height, image["detail"])
+        tokens = calculate_token_cost(image["width"], image["height"], image["detail"])
         (image_cost, _) = litellm.cost_per_token(model=model, prompt_tokens=tokens)
         cost += image_cost
 
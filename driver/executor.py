@@ -1,163 +1,258 @@
-import os
-import subprocess
+import asyncio
 import sys
-import time
-from typing import List
+from typing import List, Optional
 
-import pyautogui
-import pyperclip
-import pygetwindow
 from driver.brain import (
     extract_high_level_plan_and_actions,
     extract_structured_actions,
     plan_next_step_actions,
 )
+from driver.frame import Frame
+from driver.input_backend import input_backend, set_input_backend
 from driver.logger import print_action
+from driver.ocr_cache import ocr_cache
+from driver.perception import PerceptionState
+from driver.session import (
+    SessionRecorder,
+    SessionReplay,
+    current_session,
+    set_session,
+)
+from driver.settle import wait_for_settle
 from driver.annotator import annotate_image
-from driver.types import Action, DebugConfig, LabelMap, Context, LabelMapItem
+from driver.artifacts import ArtifactSink, artifact_sink
+from driver.trace import span, tracer
+from driver.types import (
+    Action,
+    DebugConfig,
+    LabelMap,
+    Context,
+    LabelMapItem,
+    Press,
+    StepState,
+)
 from colorama import Fore, Style
 
 from driver.utils import is_retina_display
 
 
 def take_screenshot():
-    screenshot = pyautogui.screenshot()
-    os.makedirs("./output", exist_ok=True)
-    screenshot.save("./output/screenshot.png")
-    return "./output/screenshot.png"
+    return current_session().screenshot(
+        lambda: Frame.from_pil(input_backend().screenshot())
+    )
 
 
-def start(task: str, debug: DebugConfig):
-    screenshot = take_screenshot()
-    label_map, output_image_path, img_multiplier_factor = annotate_image(
-        screenshot, debug=debug
-    )
+def start(task: Optional[str], debug: DebugConfig):
+    tracer.export_path = debug["trace"]
+    ocr_cache.directory = debug["ocr_cache_dir"]
+    if debug["replay"]:
+        # screenshots, OCR and LLM responses from the archive, inputs to a fake backend
+        replay = SessionReplay(debug["replay"])
+        task, debug = replay.task, replay.replay_config(debug)
+        set_session(replay)
+        set_input_backend(replay.inputs)
+    elif debug["record"]:
+        set_session(SessionRecorder(debug["record"], task, debug))
 
+    try:
+        asyncio.run(agent_loop(task, debug))
+    finally:
+        current_session().close()
+
+
+async def agent_loop(task: str, debug: DebugConfig):
     context: Context = {
         "task": task,
         "history": [],
         "high_level_plan": "",
         "actions_history": [],
-        "img_multiplier_factor": img_multiplier_factor,
+        "img_multiplier_factor": {"width": 1, "height": 1},
         "debug": debug,
+        "step_state": "capture",
     }
-    plan_and_actions = plan_next_step_actions(
-        context=context,
-        image_path=output_image_path,
-    )
-    if plan_and_actions:
-        high_level_plan, str_actions = extract_high_level_plan_and_actions(
-            plan_and_actions
-        )
-        context["high_level_plan"] = high_level_plan or ""
-    else:
-        raise Exception(f"No plan and actions were written: {plan_and_actions}")
 
-    parse_actions_and_execute(
-        label_map=label_map, context=context, str_actions=str_actions
+    perception = PerceptionState() if debug["incremental"] else None
+
+    # Iterate instead of having each step call the next one, so the stack does not grow
+    # with the task length and everything a step creates is released when it returns
+    while await run_step(context, perception):
+        pass
+
+    print(
+        Fore.GREEN
+        + "\nNo actions found, assuming our job here is done! Exiting"
+        + Style.RESET_ALL
     )
 
 
-def next_step(context: Context):
-    screenshot = take_screenshot()
-    label_map, output_image_path, img_multiplier_factor = annotate_image(
-        screenshot, debug=context["debug"]
+async def run_step(context: Context, perception: Optional[PerceptionState]) -> bool:
+    """
+    Goes through the capture -> perceive -> plan -> act -> settle states once,
+    returns False when there are no more actions to execute
+    """
+    tracer.start_step()
+    try:
+        # the debugging files of the whole step, written following debug["artifacts"],
+        # with "on-error" only if any state of the step raises
+        with artifact_sink(context["debug"]) as artifacts:
+            return await run_step_states(context, perception, artifacts)
+    finally:
+        tracer.end_step()
+
+
+async def run_step_states(
+    context: Context, perception: Optional[PerceptionState], artifacts: ArtifactSink
+) -> bool:
+    set_state(context, "capture")
+    with span("capture"):
+        screenshot = await asyncio.to_thread(take_screenshot)
+
+    set_state(context, "perceive")
+    label_map, annotated_image, img_multiplier_factor = await asyncio.to_thread(
+        annotate_image,
+        screenshot,
+        debug=context["debug"],
+        perception=perception,
+        artifacts=artifacts,
     )
     context["img_multiplier_factor"] = img_multiplier_factor
-    str_actions = plan_next_step_actions(
+    del screenshot
+
+    set_state(context, "plan")
+    is_first_step = len(context["history"]) == 0
+    str_actions = await plan_next_step_actions(
         context=context,
-        image_path=output_image_path,
-    )
-    parse_actions_and_execute(
-        label_map=label_map, context=context, str_actions=str_actions
+        image=annotated_image,
     )
+    del annotated_image
+    if is_first_step:
+        if not str_actions:
+            raise Exception(f"No plan and actions were written: {str_actions}")
+        high_level_plan, str_actions = extract_high_level_plan_and_actions(
+            str_actions
+        )
+        context["high_level_plan"] = high_level_plan or ""
 
+    with span("action_parsing"):
+        actions = await asyncio.to_thread(parse_actions, context, str_actions)
+    if len(actions) == 0:
+        return False
+
+    set_state(context, "act")
+    sent_input = await execute(context, label_map=label_map, actions=actions)
+
+    set_state(context, "settle")
+    # Refresh the screenshot only once the screen stops changing
+    await settle(context, after_input=sent_input)
+    print("Refreshing screenshot")
 
-def parse_actions_and_execute(
-    context: Context, label_map: LabelMap, str_actions: str | None
-):
+    return True
+
+
+def set_state(context: Context, state: StepState):
+    context["step_state"] = state
+
+
+async def settle(context: Context, after_input: bool):
+    """
+    :param after_input: whether inputs were sent since the last settle, the screen
+                        then gets settle_min_wait seconds to start changing
+    """
+    with span("settle"):
+        await wait_for_settle(
+            timeout=context["debug"]["settle_timeout"],
+            threshold=context["debug"]["settle_threshold"],
+            min_wait=context["debug"]["settle_min_wait"] if after_input else 0.0,
+        )
+
+
+def parse_actions(context: Context, str_actions: str | None) -> List[Action]:
     if str_actions:
         actions = extract_structured_actions(input=str_actions) or []
         context["actions_history"].append(actions)
     else:
         raise Exception(f"No actions found on the plan: {str_actions}")
-
-    if len(actions) > 0:
-        execute(context, label_map=label_map, actions=actions)
-    else:
-        print(
-            Fore.GREEN
-            + "\nNo actions found, assuming our job here is done! Exiting"
-            + Style.RESET_ALL
-        )
-        sys.exit(0)
+    return actions
 
 
-def execute(context: Context, label_map: LabelMap, actions: List[Action]):
+async def execute(
+    context: Context, label_map: LabelMap, actions: List[Action]
+) -> bool:
+    """
+    :return: whether inputs were sent since the last settle
+    """
     print_action("Executing actions")
 
-    for action in actions:
-        if action["action"] == "CLICK":
-            if action["label"] not in label_map:
-                print(
-                    f"WARN: Label {action['label']} not present in the screenshot, skipping CLICK action"
-                )
-                continue
-            item = label_map[action["label"]]
-            print(f"Clicking {item}")
-            click(item)
-        elif action["action"] == "TYPE":
-            if "label" in action and action["label"] in label_map:
+    sent_input = False
+    for i, action in enumerate(actions):
+        if i > 0:
+            # wait for the screen to react in between actions
+            await settle(context, after_input=sent_input)
+            sent_input = False
+
+        current_session().action(action)
+
+        with span("action", action=action["action"]):
+            if action["action"] == "CLICK":
+                if action["label"] not in label_map:
+                    print(
+                        f"WARN: Label {action['label']} not present in the screenshot, skipping CLICK action"
+                    )
+                    continue
                 item = label_map[action["label"]]
                 print(f"Clicking {item}")
-                click(item)
-            type(action["text"])
-        elif action["action"] == "PRESS":
-            modifier_map = {
-                "CMD": "command",
-                "CTRL": "ctrl",
-                "ALT": "alt",
-                "SHIFT": "shift",
-            }
-
-            if (
-                "modifier" in action
-                and action["modifier"]
-                and "second_modifier" in action
-                and action["second_modifier"]
-            ):
-                print(
-                    f"Executing shortcut {action['modifier']}+{action['second_modifier']}+{action['key']}"
-                )
-                pyautogui.hotkey(
-                    modifier_map[action["modifier"]],
-                    modifier_map[action["second_modifier"]],
-                    action["key"].lower(),
-                    interval=0.1,
-                )
-            elif "modifier" in action and action["modifier"]:
-                print(f"Executing shortcut {action['modifier']}+{action['key']}")
-                pyautogui.hotkey(
-                    modifier_map[action["modifier"]],
-                    action["key"].lower(),
-                    interval=0.1,
-                )
+                await asyncio.to_thread(click, item)
+                sent_input = True
+            elif action["action"] == "TYPE":
+                if "label" in action and action["label"] in label_map:
+                    item = label_map[action["label"]]
+                    print(f"Clicking {item}")
+                    await asyncio.to_thread(click, item)
+                await asyncio.to_thread(type, action["text"])
+                sent_input = True
+            elif action["action"] == "PRESS":
+                await asyncio.to_thread(press, action)
+                sent_input = True
+            elif action["action"] == "REFRESH":
+                return sent_input
             else:
-                print(f"Pressing {action['key']}")
-                pyautogui.press(action["key"].lower(), interval=0.1)
-        elif action["action"] == "REFRESH":
-            time.sleep(1)
-            print("Refreshing screenshot")
-            next_step(context)
-            return
-        else:
-            print("Unknown action")
-        time.sleep(0.2)  # little bit of sleep in between actions
+                print("Unknown action")
+    return sent_input
 
-    # Refresh by default if refresh was not issued
-    time.sleep(2)
-    print("Refreshing screenshot")
-    next_step(context)
+
+def press(action: Press):
+    modifier_map = {
+        "CMD": "command",
+        "CTRL": "ctrl",
+        "ALT": "alt",
+        "SHIFT": "shift",
+    }
+
+    if (
+        "modifier" in action
+        and action["modifier"]
+        and "second_modifier" in action
+        and action["second_modifier"]
+    ):
+        print(
+            f"Executing shortcut {action['modifier']}+{action['second_modifier']}+{action['key']}"
+        )
+        input_backend().hotkey(
+            modifier_map[action["modifier"]],
+            modifier_map[action["second_modifier"]],
+            action["key"].lower(),
+            interval=0.1,
+        )
+    elif "modifier" in action and action["modifier"]:
+        print(f"Executing shortcut {action['modifier']}+{action['key']}")
+        input_backend().hotkey(
+            modifier_map[action["modifier"]],
+            action["key"].lower(),
+            interval=0.1,
+        )
+    else:
+        print(f"Pressing {action['key']}")
+        input_backend().press(action["key"].lower(), interval=0.1)
 
 
 def click(item: LabelMapItem):
@@ -166,49 +261,27 @@ def click(item: LabelMapItem):
         round(item["position"][0] / division) + 24,
         round(item["position"][1] / division) + 12,
     )
-    pyautogui.moveTo(x, y, duration=0.5)
-    window = pygetwindow.getWindowsAt(x, y)
+    inputs = input_backend()
+    inputs.move_to(x, y, duration=0.5)
+    window = inputs.windows_at(x, y)
     if window:
-        focused_window = get_active_window()
+        focused_window = inputs.active_window()
         if focused_window and focused_window not in window[0]:
-            pyautogui.click()  # one extra click to focus the window
-    pyautogui.click()
-
-
-def get_active_window():
-    if sys.platform == "darwin":
-        applescript_command = """
-        tell application "System Events"
-            set frontApp to name of first application process whose frontmost is true
-            tell process frontApp
-                set windowTitle to name of front window
-            end tell
-        end tell
-        return windowTitle
-        """
-
-        try:
-            frontmost_app_name = subprocess.check_output(
-                ["osascript", "-e", applescript_command], text=True
-            ).strip()
-            return frontmost_app_name
-        except subprocess.CalledProcessError:
-            return None
-    else:
-        return pygetwindow.getActiveWindow()
+            inputs.click()  # one extra click to focus the window
+    inputs.click()
 
 
 def type(text):
     text = text.replace("\\n", "\n")
     print(f"Typing {text}")
     if contains_non_typeable_characters(text):
-        pyperclip.copy(text)
+        input_backend().copy(text)
         if sys.platform == "darwin":
-            pyautogui.hotkey("command", "v", interval=0.1)
+            input_backend().hotkey("command", "v", interval=0.1)
         else:
-            pyautogui.hotkey("ctrl", "v", interval=0.1)
+            input_backend().hotkey("ctrl", "v", interval=0.1)
     else:
-        pyautogui.write(text, interval=0.05)
+        input_backend().write(text, interval=0.05)
 
 
 def contains_non_typeable_characters(text):
@@ -0,0 +1,87 @@
+import base64
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".webp": "image/webp"}
+QUALITY_FLAGS = {".jpg": cv2.IMWRITE_JPEG_QUALITY, ".webp": cv2.IMWRITE_WEBP_QUALITY}
+
+
+@dataclass
+class Frame:
+    """
+    A captured screen kept in memory as a BGR NumPy buffer (the same layout
+    cv2.imread gives), passed through OCR, UIED, annotation and the LLM encoder
+    so the pixels are decoded once per step instead of once per stage
+    """
+
+    pixels: np.ndarray
+    name: str = "screenshot"
+    _resized: Dict[int, np.ndarray] = field(default_factory=dict, repr=False)
+    _encoded: Dict[Tuple[str, Optional[int]], bytes] = field(
+        default_factory=dict, repr=False
+    )
+
+    @classmethod
+    def from_pil(cls, image: Image.Image, name="screenshot"):
+        rgb = np.asarray(image.convert("RGB"))
+        return cls(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), name=name)
+
+    @classmethod
+    def from_file(cls, path: str):
+        pixels = cv2.imread(path)
+        if pixels is None:
+            raise Exception(f"Could not read image {path}")
+        name = path.replace("\\", "/").split("/")[-1][:-4]
+        return cls(pixels, name=name)
+
+    @property
+    def shape(self):
+        return self.pixels.shape
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    def resized(self, height: int) -> np.ndarray:
+        """
+        Resize keeping the aspect ratio, the same way UIED's pre.read_img does,
+        cached so compo_detection and merge share a single resize
+        """
+        height = int(height)
+        if height not in self._resized:
+            w_h_ratio = self.width / self.height
+            self._resized[height] = cv2.resize(
+                self.pixels, (int(height * w_h_ratio), height)
+            )
+        return self._resized[height]
+
+    def to_pil(self) -> Image.Image:
+        return Image.fromarray(cv2.cvtColor(self.pixels, cv2.COLOR_BGR2RGB))
+
+    def encode(self, ext=".png", quality: Optional[int] = None) -> bytes:
+        """
+        :param quality: 0-100 for the lossy .jpg and .webp, ignored for .png
+        """
+        key = (ext, quality)
+        if key not in self._encoded:
+            params = []
+            if quality is not None and ext in QUALITY_FLAGS:
+                params = [QUALITY_FLAGS[ext], int(quality)]
+            success, buffer = cv2.imencode(ext, self.pixels, params)
+            if not success:
+                raise Exception(f"Could not encode frame {self.name} as {ext}")
+            self._encoded[key] = buffer.tobytes()
+        return self._encoded[key]
+
+    def to_base64(self, ext=".png", quality: Optional[int] = None) -> str:
+        encoded_string = base64.b64encode(self.encode(ext, quality)).decode("utf-8")
+        return f"data:{MIME_TYPES[ext]};base64,{encoded_string}"
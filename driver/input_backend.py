@@ -0,0 +1,120 @@
+import subprocess
+import sys
+from typing import Any, List, Optional, Tuple
+
+from PIL import Image
+
+
+class InputBackend:
+    """
+    The screen captures and mouse and keyboard inputs the agent makes, through
+    pyautogui, pyperclip and pygetwindow, imported only when the backend is created
+    so a replay runs without a display
+    """
+
+    def __init__(self):
+        import pyautogui
+        import pyperclip
+        import pygetwindow
+
+        self.pyautogui = pyautogui
+        self.pyperclip = pyperclip
+        self.pygetwindow = pygetwindow
+
+    def screenshot(self) -> Image.Image:
+        return self.pyautogui.screenshot()
+
+    def move_to(self, x: int, y: int, duration: float):
+        self.pyautogui.moveTo(x, y, duration=duration)
+
+    def click(self):
+        self.pyautogui.click()
+
+    def hotkey(self, *keys: str, interval: float):
+        self.pyautogui.hotkey(*keys, interval=interval)
+
+    def press(self, key: str, interval: float):
+        self.pyautogui.press(key, interval=interval)
+
+    def write(self, text: str, interval: float):
+        self.pyautogui.write(text, interval=interval)
+
+    def copy(self, text: str):
+        self.pyperclip.copy(text)
+
+    def windows_at(self, x: int, y: int) -> List[Any]:
+        return self.pygetwindow.getWindowsAt(x, y)
+
+    def active_window(self):
+        if sys.platform == "darwin":
+            applescript_command = """
+            tell application "System Events"
+                set frontApp to name of first application process whose frontmost is true
+                tell process frontApp
+                    set windowTitle to name of front window
+                end tell
+            end tell
+            return windowTitle
+            """
+
+            try:
+                frontmost_app_name = subprocess.check_output(
+                    ["osascript", "-e", applescript_command], text=True
+                ).strip()
+                return frontmost_app_name
+            except subprocess.CalledProcessError:
+                return None
+        else:
+            return self.pygetwindow.getActiveWindow()
+
+
+class FakeInputBackend(InputBackend):
+    """
+    Backend of a replay: shows the screen it is given and only records the inputs
+    """
+
+    def __init__(self, screen: Optional[Image.Image] = None):
+        self.screen = screen or Image.new("RGB", (1, 1))
+        self.inputs: List[Tuple[Any, ...]] = []
+
+    def screenshot(self) -> Image.Image:
+        return self.screen
+
+    def move_to(self, x: int, y: int, duration: float):
+        self.inputs.append(("move_to", x, y))
+
+    def click(self):
+        self.inputs.append(("click",))
+
+    def hotkey(self, *keys: str, interval: float):
+        self.inputs.append(("hotkey", *keys))
+
+    def press(self, key: str, interval: float):
+        self.inputs.append(("press", key))
+
+    def write(self, text: str, interval: float):
+        self.inputs.append(("write", text))
+
+    def copy(self, text: str):
+        self.inputs.append(("copy", text))
+
+    def windows_at(self, x: int, y: int) -> List[Any]:
+        return []
+
+    def active_window(self):
+        return None
+
+
+backend: Optional[InputBackend] = None
+
+
+def input_backend() -> InputBackend:
+    global backend
+    if backend is None:
+        backend = InputBackend()
+    return backend
+
+
+def set_input_backend(new_backend: InputBackend):
+    global backend
+    backend = new_backend
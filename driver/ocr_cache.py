@@ -0,0 +1,151 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import cv2
+
+from driver.frame import Frame
+from driver.types import (
+    AnnotatedImage,
+    BoundingPoly,
+    OCRCacheMode,
+    TextAnnotation,
+    Vertex,
+)
+
+
+def annotated_image_to_dict(result: AnnotatedImage) -> Dict[str, Any]:
+    return {
+        "text_annotations": [
+            {
+                "description": annotation.description,
+                "vertices": [
+                    [vertex.x, vertex.y]
+                    for vertex in annotation.bounding_poly.vertices
+                ],
+            }
+            for annotation in result.text_annotations
+        ]
+    }
+
+
+def annotated_image_from_dict(data: Dict[str, Any]) -> AnnotatedImage:
+    return AnnotatedImage(
+        text_annotations=[
+            TextAnnotation(
+                description=annotation["description"],
+                bounding_poly=BoundingPoly(
+                    vertices=[Vertex(x=x, y=y) for x, y in annotation["vertices"]]
+                ),
+            )
+            for annotation in data["text_annotations"]
+        ]
+    )
+
+
+def image_hash(frame: Frame, mode: OCRCacheMode) -> str:
+    """
+    exact: hash of the raw pixels, any change is a miss
+    perceptual: hash of a 4x smaller greyscale copy quantized to 16 levels, so
+                compression noise or sub-pixel anti-aliasing changes still hit
+    """
+    if mode == "perceptual":
+        grey = cv2.cvtColor(frame.pixels, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(
+            grey, (max(1, frame.width // 4), max(1, frame.height // 4)),
+            interpolation=cv2.INTER_AREA,
+        )
+        pixels = small >> 4
+    else:
+        pixels = frame.pixels
+    digest = hashlib.sha1(str(frame.shape).encode())
+    digest.update(pixels.tobytes())
+    return digest.hexdigest()
+
+
+class OCRCache:
+    """
+    OCR results keyed by provider and image hash, kept in an in-memory LRU and
+    optionally persisted as json files so they are reused across runs
+    """
+
+    def __init__(
+        self, directory: Optional[str] = None, max_entries=128, max_files=512
+    ):
+        """
+        :param directory: where the results are persisted, None to keep them in memory
+        :param max_files: files kept in directory, the least recently used are removed
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_files = max_files
+        self.entries: OrderedDict[str, AnnotatedImage] = OrderedDict()
+        self.lock = threading.Lock()
+        self.files_lock = threading.Lock()
+
+    def key(self, frame: Frame, provider: str, mode: OCRCacheMode) -> str:
+        return f"{provider}-{mode}-{image_hash(frame, mode)}"
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key: str) -> Optional[AnnotatedImage]:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key)) as f:
+                result = annotated_image_from_dict(json.load(f))
+            # the modification time orders the files for eviction
+            os.utime(self.path(key))
+        except (OSError, ValueError, KeyError):
+            return None
+
+        self.remember(key, result)
+        return result
+
+    def put(self, key: str, result: AnnotatedImage):
+        self.remember(key, result)
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file first so a crash never leaves a truncated entry
+        tmp_path = f"{self.path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(annotated_image_to_dict(result), f)
+        os.replace(tmp_path, self.path(key))
+        self.evict_files()
+
+    def evict_files(self):
+        """
+        Removes the least recently written or read files above max_files
+        """
+        with self.files_lock:
+            files = []
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".json"):
+                        files.append((entry.stat().st_mtime, entry.path))
+            files.sort()
+            for _, path in files[: max(0, len(files) - self.max_files)]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def remember(self, key: str, result: AnnotatedImage):
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+ocr_cache = OCRCache()
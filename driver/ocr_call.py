@@ -1,31 +1,36 @@
-import base64
-from dataclasses import dataclass
-import json
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
+import io
 import os
-from typing import List, cast
+from typing import List, Optional, cast
 
-import requests
+import numpy as np
 from urllib.parse import urlencode, quote_plus
 
+from driver.frame import Frame
 from driver.logger import print_action
-from google.cloud import vision
-from azure.cognitiveservices.vision.computervision import ComputerVisionClient
-from azure.cognitiveservices.vision.computervision.models import (
-    OcrResult,
+from driver.ocr_cache import ocr_cache
+from driver.ocr_tiles import stitch_tiles, tile_rects
+from driver.ocr_upload import prepare_upload, scale_annotations, upload_settings
+from driver.trace import span
+from driver.ocr_clients import (
+    azure_client,
+    baidu_access_token,
+    google_client,
+    http_session,
 )
-from msrest.authentication import CognitiveServicesCredentials
 
 from driver.types import (
     AnnotatedImage,
     BoundingPoly,
     DebugConfig,
+    OCRCacheMode,
     TextAnnotation,
     Vertex,
 )
-from driver.utils import image_to_base64
 
 
-def ocr_text_detection(input_image_path, config: DebugConfig) -> AnnotatedImage:
+def ocr_text_detection(frame: Frame, config: DebugConfig) -> AnnotatedImage:
     ocr_provider = config["ocr_provider"]
     if not ocr_provider:
         if os.environ.get("AZURE_VISION_API_KEY"):
@@ -34,52 +39,153 @@ def ocr_text_detection(input_image_path, config: DebugConfig) -> AnnotatedImage:
             ocr_provider = "google"
         elif os.environ.get("BAIDU_OCR_API_KEY"):
             ocr_provider = "baidu"
+        elif importlib.util.find_spec("pytesseract"):
+            ocr_provider = "tesseract"
 
-    if ocr_provider == "azure":
-        print_action("Annotating screenshot with Azure Vision")
-        return azure_ocr_text_detect(input_image_path)
-    elif ocr_provider == "google":
-        print_action("Annotating screenshot with Google Cloud Vision")
-        return google_ocr_text_detect(input_image_path)
-    elif ocr_provider == "baidu":
-        print_action("Annotating screenshot with Baidu Vision")
-        return baidu_ocr_text_detect(input_image_path)
-    else:
+    if ocr_provider not in ["azure", "google", "baidu", "tesseract"]:
         raise Exception(
-            "No OCR API env variable set, please set either AZURE_VISION_API_KEY or GCLOUD_VISION_API_KEY"
+            "No OCR API env variable set, please set either AZURE_VISION_API_KEY or GCLOUD_VISION_API_KEY, or install pytesseract to run OCR locally"
         )
 
+    cache_mode = config["ocr_cache"]
+    rows, cols = config["ocr_tiles"]
+    if rows * cols > 1:
+        return tiled_ocr_text_detection(frame, ocr_provider, cache_mode, rows, cols)
+
+    cached = cache_lookup(frame, ocr_provider, cache_mode)
+    if cached is not None:
+        print_action("Annotating screenshot with cached OCR result")
+        return cached
+
+    print_action(f"Annotating screenshot with {provider_names[ocr_provider]}")
+    return cache_store(frame, ocr_provider, cache_mode, provider_text_detect(frame, ocr_provider))
+
+
+provider_names = {
+    "azure": "Azure Vision",
+    "google": "Google Cloud Vision",
+    "baidu": "Baidu Vision",
+    "tesseract": "Tesseract",
+}
+
+# Tiles missing from the cache are sent to the OCR provider in parallel
+tiles_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ocr-tile")
 
-def google_ocr_text_detect(input_image_path) -> AnnotatedImage:
-    client_options = {
-        "api_endpoint": "eu-vision.googleapis.com",
-        "api_key": os.environ.get("GCLOUD_VISION_API_KEY"),
-    }
 
-    client = vision.ImageAnnotatorClient(client_options=client_options)
-    with open(input_image_path, "rb") as image_file:
-        content = image_file.read()
+def provider_text_detect(frame: Frame, ocr_provider: str) -> AnnotatedImage:
+    with span("ocr_request", provider=ocr_provider):
+        if ocr_provider == "tesseract":
+            return tesseract_ocr_text_detect(frame)
 
-    image = vision.Image(content=content)
-    response = client.text_detection(image=image)  # type: ignore
-    return response
+        # cloud providers get a smaller upload, as it dominates their latency
+        settings = upload_settings(ocr_provider)
+        upload = prepare_upload(frame, settings)
+        if ocr_provider == "azure":
+            result = azure_ocr_text_detect(upload, settings.ext, settings.quality)
+        elif ocr_provider == "google":
+            result = google_ocr_text_detect(upload, settings.ext, settings.quality)
+        else:
+            result = baidu_ocr_text_detect(upload, settings.ext, settings.quality)
+        return scale_annotations(result, upload, frame)
 
 
-def azure_ocr_text_detect(input_image_path) -> AnnotatedImage:
-    subscription_key = os.environ["AZURE_VISION_API_KEY"]
-    endpoint = os.environ["AZURE_VISION_ENDPOINT"]
+def cache_lookup(
+    frame: Frame, ocr_provider: str, cache_mode: OCRCacheMode
+) -> Optional[AnnotatedImage]:
+    if cache_mode == "off":
+        return None
+    return ocr_cache.get(ocr_cache.key(frame, ocr_provider, cache_mode))
 
-    client = ComputerVisionClient(
-        endpoint, CognitiveServicesCredentials(subscription_key)
+
+def cache_store(
+    frame: Frame, ocr_provider: str, cache_mode: OCRCacheMode, result: AnnotatedImage
+) -> AnnotatedImage:
+    if cache_mode != "off":
+        ocr_cache.put(ocr_cache.key(frame, ocr_provider, cache_mode), result)
+    return result
+
+
+def tiled_ocr_text_detection(
+    frame: Frame, ocr_provider: str, cache_mode: OCRCacheMode, rows: int, cols: int
+) -> AnnotatedImage:
+    """
+    Splits the screenshot in overlapping tiles cached separately, so a change like a
+    clock ticking only sends the tile it is in to the OCR provider
+    """
+    tiles = tile_rects(frame.height, frame.width, rows, cols)
+    tile_frames = [
+        Frame(
+            np.ascontiguousarray(frame.pixels[y_min:y_max, x_min:x_max]),
+            name=f"{frame.name}-tile{i}",
+        )
+        for i, (x_min, y_min, x_max, y_max) in enumerate(tiles)
+    ]
+    results = [cache_lookup(tile, ocr_provider, cache_mode) for tile in tile_frames]
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if len(missing) == 0:
+        print_action("Annotating screenshot with cached OCR result")
+    else:
+        print_action(
+            f"Annotating {len(missing)} of {len(tiles)} screenshot tiles with {provider_names[ocr_provider]}"
+        )
+    detected = tiles_executor.map(
+        lambda i: cache_store(
+            tile_frames[i],
+            ocr_provider,
+            cache_mode,
+            provider_text_detect(tile_frames[i], ocr_provider),
+        ),
+        missing,
+    )
+    for i, result in zip(missing, detected):
+        results[i] = result
+
+    return stitch_tiles(
+        tiles,
+        cast(List[AnnotatedImage], results),
+        frame.height,
+        frame.width,
+        has_full_text=ocr_provider in ["google", "tesseract"],
     )
 
-    with open(input_image_path, "rb") as image_file:
-        image_analysis = cast(
-            OcrResult,
-            client.recognize_printed_text_in_stream(
-                image=image_file,
+
+def google_ocr_text_detect(
+    frame: Frame, ext=".png", quality: Optional[int] = None
+) -> AnnotatedImage:
+    from google.cloud import vision
+
+    image = vision.Image(content=frame.encode(ext, quality))
+    response = google_client().text_detection(image=image)  # type: ignore
+
+    annotations: List[TextAnnotation] = [
+        TextAnnotation(
+            description=annotation.description,
+            bounding_poly=BoundingPoly(
+                vertices=[
+                    Vertex(x=vertex.x, y=vertex.y)
+                    for vertex in annotation.bounding_poly.vertices
+                ]
             ),
         )
+        for annotation in response.text_annotations
+    ]
+    result = AnnotatedImage(text_annotations=annotations)
+
+    return result
+
+
+def azure_ocr_text_detect(
+    frame: Frame, ext=".png", quality: Optional[int] = None
+) -> AnnotatedImage:
+    from azure.cognitiveservices.vision.computervision.models import OcrResult
+
+    image_analysis = cast(
+        OcrResult,
+        azure_client().recognize_printed_text_in_stream(
+            image=io.BytesIO(frame.encode(ext, quality)),
+        ),
+    )
 
     annotations: List[TextAnnotation] = []
     for region in image_analysis.regions or []:
@@ -107,30 +213,16 @@ def azure_ocr_text_detect(input_image_path) -> AnnotatedImage:
     return result
 
 
-def baidu_ocr_text_detect(input_image_path) -> AnnotatedImage:
-    api_key = os.environ["BAIDU_OCR_API_KEY"]
-    secret_key = os.environ["BAIDU_OCR_SECRET_KEY"]
-
-    def get_access_token():
-        url = "https://aip.baidubce.com/oauth/2.0/token"
-        params = {
-            "grant_type": "client_credentials",
-            "client_id": api_key,
-            "client_secret": secret_key,
-        }
-        return str(requests.post(url, params=params).json().get("access_token"))
-
-    url = (
-        "https://aip.baidubce.com/rest/2.0/ocr/v1/accurate?access_token="
-        + get_access_token()
-    )
+def baidu_ocr_text_detect(
+    frame: Frame, ext=".png", quality: Optional[int] = None
+) -> AnnotatedImage:
     payload = urlencode(
         {
             "detect_direction": "false",
             "vertexes_location": "true",
             "paragraph": "false",
             "probability": "false",
-            "image": image_to_base64(input_image_path),
+            "image": frame.to_base64(ext, quality),
         },
         quote_via=quote_plus,
     )
@@ -138,10 +230,21 @@ def baidu_ocr_text_detect(input_image_path) -> AnnotatedImage:
         "Content-Type": "application/x-www-form-urlencoded",
         "Accept": "application/json",
     }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.status_code != 200 or "error_code" in json.loads(response.text):
+
+    def request(access_token: str):
+        url = (
+            "https://aip.baidubce.com/rest/2.0/ocr/v1/accurate?access_token="
+            + access_token
+        )
+        return http_session().post(url, headers=headers, data=payload)
+
+    response = request(baidu_access_token())
+    # 110 and 111 are an invalid or expired token, get a new one and try again
+    if response.status_code == 200 and response.json().get("error_code") in [110, 111]:
+        response = request(baidu_access_token(refresh=True))
+    if response.status_code != 200 or "error_code" in response.json():
         raise Exception("Baidu OCR failed to annotate screenshot")
-    words = json.loads(response.text)["words_result"]
+    words = response.json()["words_result"]
 
     annotations: List[TextAnnotation] = []
     for word in words:
@@ -157,3 +260,69 @@ def baidu_ocr_text_detect(input_image_path) -> AnnotatedImage:
     result = AnnotatedImage(text_annotations=annotations)
 
     return result
+
+
+def tesseract_ocr_text_detect(frame: Frame) -> AnnotatedImage:
+    """
+    Runs locally with no network or keys, needs the tesseract binary and
+    `pip install pytesseract`. Returns the whole text first followed by each
+    word, like Google Vision does
+    """
+    try:
+        import pytesseract
+    except ImportError:
+        raise Exception(
+            "pytesseract is not installed, please run `pip install pytesseract` and install tesseract to use local OCR"
+        )
+
+    data = pytesseract.image_to_data(
+        frame.to_pil(),
+        lang=os.environ.get("TESSERACT_LANG", "eng"),
+        output_type=pytesseract.Output.DICT,
+    )
+
+    annotations: List[TextAnnotation] = []
+    lines: List[str] = []
+    line_key = None
+    for i, word in enumerate(data["text"]):
+        word = word.strip()
+        if not word or float(data["conf"][i]) < 0:
+            continue
+
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        if key == line_key:
+            lines[-1] += " " + word
+        else:
+            lines.append(word)
+            line_key = key
+
+        left, top = data["left"][i], data["top"][i]
+        right, bottom = left + data["width"][i], top + data["height"][i]
+        annotations.append(
+            TextAnnotation(
+                description=word,
+                bounding_poly=BoundingPoly(
+                    vertices=[
+                        Vertex(x=left, y=top),
+                        Vertex(x=right, y=top),
+                        Vertex(x=right, y=bottom),
+                        Vertex(x=left, y=bottom),
+                    ]
+                ),
+            )
+        )
+
+    full_text = TextAnnotation(
+        description="\n".join(lines),
+        bounding_poly=BoundingPoly(
+            vertices=[
+                Vertex(x=0, y=0),
+                Vertex(x=frame.width, y=0),
+                Vertex(x=frame.width, y=frame.height),
+                Vertex(x=0, y=frame.height),
+            ]
+        ),
+    )
+    result = AnnotatedImage(text_annotations=[full_text] + annotations)
+
+    return result
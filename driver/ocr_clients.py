@@ -0,0 +1,76 @@
+import functools
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Clients are created on first use and reused for every request afterwards, keeping
+# their connections alive instead of doing a new TLS handshake on each step. The
+# cloud SDKs are imported lazily, so only the provider in use needs to be installed
+
+POOL_SIZE = 8  # as many connections as OCR tiles can be requested in parallel
+
+
+@functools.lru_cache(maxsize=None)
+def google_client():
+    from google.cloud import vision
+
+    client_options = {
+        "api_endpoint": "eu-vision.googleapis.com",
+        "api_key": os.environ.get("GCLOUD_VISION_API_KEY"),
+    }
+    return vision.ImageAnnotatorClient(client_options=client_options)
+
+
+@functools.lru_cache(maxsize=None)
+def azure_client():
+    from azure.cognitiveservices.vision.computervision import ComputerVisionClient
+    from msrest.authentication import CognitiveServicesCredentials
+
+    subscription_key = os.environ["AZURE_VISION_API_KEY"]
+    endpoint = os.environ["AZURE_VISION_ENDPOINT"]
+    return ComputerVisionClient(endpoint, CognitiveServicesCredentials(subscription_key))
+
+
+@functools.lru_cache(maxsize=None)
+def http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+baidu_token_lock = threading.Lock()
+baidu_token: Optional[Tuple[str, float]] = None  # (access token, expiry timestamp)
+
+
+def baidu_access_token(refresh=False, expiry_margin=60) -> str:
+    """
+    Baidu OAuth access token, cached until it expires (a month usually) instead
+    of costing an extra round trip before every OCR request
+    :param refresh: discard the cached token, e.g. after Baidu rejected it
+    """
+    global baidu_token
+    with baidu_token_lock:
+        if baidu_token is not None and not refresh and time.time() < baidu_token[1]:
+            return baidu_token[0]
+
+        url = "https://aip.baidubce.com/oauth/2.0/token"
+        params = {
+            "grant_type": "client_credentials",
+            "client_id": os.environ["BAIDU_OCR_API_KEY"],
+            "client_secret": os.environ["BAIDU_OCR_SECRET_KEY"],
+        }
+        response = http_session().post(url, params=params).json()
+        if "access_token" not in response:
+            raise Exception("Baidu OCR failed to get an access token")
+        expires_in = float(response.get("expires_in", 0))
+        baidu_token = (
+            str(response["access_token"]),
+            time.time() + max(0, expires_in - expiry_margin),
+        )
+        return baidu_token[0]
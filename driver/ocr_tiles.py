@@ -0,0 +1,111 @@
+from typing import Dict, List, Tuple
+
+from driver.types import AnnotatedImage, BoundingPoly, TextAnnotation, Vertex
+
+Tile = Tuple[int, int, int, int]  # (x_min, y_min, x_max, y_max) in screenshot pixels
+
+
+def tile_rects(height: int, width: int, rows: int, cols: int, overlap=64) -> List[Tile]:
+    """
+    Splits the screen in rows x cols tiles overlapping each other by overlap pixels,
+    which should be taller than the tallest text so every word fits whole in a tile.
+    Prefer a single column: lines of text are wider than any overlap, so a tile
+    edge in the middle of a line would cut it on both sides
+    """
+    tiles = []
+    for row in range(rows):
+        for col in range(cols):
+            y_min = height * row // rows
+            y_max = height * (row + 1) // rows
+            x_min = width * col // cols
+            x_max = width * (col + 1) // cols
+            tiles.append(
+                (
+                    max(0, x_min - overlap),
+                    max(0, y_min - overlap),
+                    min(width, x_max + overlap),
+                    min(height, y_max + overlap),
+                )
+            )
+    return tiles
+
+
+def stitch_tiles(
+    tiles: List[Tile],
+    results: List[AnnotatedImage],
+    height: int,
+    width: int,
+    has_full_text=False,
+    edge_margin=2,
+) -> AnnotatedImage:
+    """
+    Moves each tile's annotations back to screen coordinates and merges them, dropping
+    the ones cut by an inner tile edge and the duplicates seen by two overlapping tiles
+    :param has_full_text: the first annotation of each result is the whole text of the
+                          image (like Google Vision returns), rebuild it for the stitched one
+    """
+    annotations: List[TextAnnotation] = []
+    boxes_by_text: Dict[str, List[Tuple[int, int, int, int]]] = {}
+    for tile, result in zip(tiles, results):
+        x_min, y_min, x_max, y_max = tile
+        tile_annotations = result.text_annotations
+        if has_full_text:
+            tile_annotations = tile_annotations[1:]
+        for annotation in tile_annotations:
+            vertices = [
+                Vertex(x=vertex.x + x_min, y=vertex.y + y_min)
+                for vertex in annotation.bounding_poly.vertices
+            ]
+            box = (
+                min(v.x for v in vertices),
+                min(v.y for v in vertices),
+                max(v.x for v in vertices),
+                max(v.y for v in vertices),
+            )
+
+            # the word is cut by the edge of the tile, the neighbour tile has it whole
+            if (
+                (x_min > 0 and box[0] <= x_min + edge_margin)
+                or (y_min > 0 and box[1] <= y_min + edge_margin)
+                or (x_max < width and box[2] >= x_max - edge_margin)
+                or (y_max < height and box[3] >= y_max - edge_margin)
+            ):
+                continue
+
+            same_text_boxes = boxes_by_text.setdefault(annotation.description, [])
+            if any(box_iou(box, other) > 0.5 for other in same_text_boxes):
+                continue
+
+            annotations.append(
+                TextAnnotation(
+                    description=annotation.description,
+                    bounding_poly=BoundingPoly(vertices=vertices),
+                )
+            )
+            same_text_boxes.append(box)
+
+    if has_full_text:
+        full_text = TextAnnotation(
+            description="\n".join(a.description for a in annotations),
+            bounding_poly=BoundingPoly(
+                vertices=[
+                    Vertex(x=0, y=0),
+                    Vertex(x=width, y=0),
+                    Vertex(x=width, y=height),
+                    Vertex(x=0, y=height),
+                ]
+            ),
+        )
+        annotations.insert(0, full_text)
+
+    return AnnotatedImage(text_annotations=annotations)
+
+
+def box_iou(a, b):
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0
+    inter = w * h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union
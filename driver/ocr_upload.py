@@ -0,0 +1,81 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from driver.frame import Frame
+from driver.types import AnnotatedImage, BoundingPoly, TextAnnotation, Vertex
+
+# Image formats each provider accepts, the first one being the default
+UPLOAD_FORMATS = {
+    "google": [".png", ".jpg", ".webp"],
+    "azure": [".png", ".jpg"],
+    "baidu": [".png", ".jpg"],
+}
+
+
+@dataclass
+class UploadSettings:
+    max_height: Optional[int]  # downscale taller screenshots to this height before uploading
+    ext: str
+    quality: Optional[int]  # for .jpg and .webp
+
+
+def upload_settings(ocr_provider: str) -> UploadSettings:
+    """
+    Read from the OCR_UPLOAD_MAX_HEIGHT, OCR_UPLOAD_FORMAT and OCR_UPLOAD_QUALITY
+    env variables, by default the full resolution screenshot is uploaded as png
+    """
+    max_height = os.environ.get("OCR_UPLOAD_MAX_HEIGHT")
+    quality = os.environ.get("OCR_UPLOAD_QUALITY")
+    formats = UPLOAD_FORMATS[ocr_provider]
+    ext = "." + os.environ.get("OCR_UPLOAD_FORMAT", formats[0]).lower().lstrip(".")
+    if ext == ".jpeg":
+        ext = ".jpg"
+    if ext not in formats:
+        # e.g. webp for a provider that does not accept it, jpg is the closest
+        ext = ".jpg"
+
+    return UploadSettings(
+        max_height=int(max_height) if max_height else None,
+        ext=ext,
+        quality=int(quality) if quality else None,
+    )
+
+
+def prepare_upload(frame: Frame, settings: UploadSettings) -> Frame:
+    if settings.max_height is None or frame.height <= settings.max_height:
+        return frame
+    return Frame(frame.resized(settings.max_height), name=frame.name)
+
+
+def scale_annotations(
+    result: AnnotatedImage, upload: Frame, original: Frame
+) -> AnnotatedImage:
+    """
+    Map the vertices found on a downscaled upload back to the original pixels
+    """
+    if upload is original:
+        return result
+    scale_x = original.width / upload.width
+    scale_y = original.height / upload.height
+
+    def unscale(value: Optional[int], scale: float):
+        return None if value is None else round(value * scale)
+
+    return AnnotatedImage(
+        text_annotations=[
+            TextAnnotation(
+                description=annotation.description,
+                bounding_poly=BoundingPoly(
+                    vertices=[
+                        Vertex(
+                            x=unscale(vertex.x, scale_x),  # type: ignore
+                            y=unscale(vertex.y, scale_y),  # type: ignore
+                        )
+                        for vertex in annotation.bounding_poly.vertices
+                    ]
+                ),
+            )
+            for annotation in result.text_annotations
+        ]
+    )
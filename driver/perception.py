@@ -0,0 +1,225 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from driver.UIED.run_single import detect_components
+
+# importing run_single puts the UIED modules on the path, import them the same way it does
+from detect_merge.Element import Element
+from detect_merge.merge import DetectElementsResponse, check_containment, reassign_ids
+from driver.artifacts import ArtifactSink
+from driver.frame import Frame
+from driver.ocr_call import ocr_text_detection
+from driver.session import current_session
+from driver.types import AnnotatedImage, DebugConfig
+
+# Single worker for the OCR network request, so it can run while UIED detects components locally
+ocr_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr")
+
+Rect = Tuple[int, int, int, int]  # (x_min, y_min, x_max, y_max) in screenshot pixels
+
+
+@dataclass
+class PerceptionState:
+    """
+    What the previous step saw, kept around to only re-annotate what changed
+    """
+
+    frame: Optional[Frame] = None
+    components: Optional[DetectElementsResponse] = None
+
+
+def perceive(
+    frame: Frame,
+    debug: DebugConfig,
+    resized_height: Optional[int] = None,
+    artifacts: Optional[ArtifactSink] = None,
+) -> DetectElementsResponse:
+    if debug["concurrent"]:
+        ocr_result = ocr_executor.submit(session_ocr, frame, debug)
+    else:
+        ocr_result = session_ocr(frame, debug)
+
+    return detect_components(
+        frame,
+        ocr_result,
+        showOCR=debug["ocr"],
+        showUIED=debug["uied"],
+        resized_height=resized_height,
+        artifacts=artifacts,
+    )
+
+
+def session_ocr(frame: Frame, debug: DebugConfig) -> AnnotatedImage:
+    """
+    OCR of the frame, recorded or replayed by the current session
+    """
+    return current_session().ocr(lambda: ocr_text_detection(frame, debug))
+
+
+def perceive_incremental(
+    frame: Frame,
+    debug: DebugConfig,
+    state: PerceptionState,
+    max_dirty_ratio=0.4,
+    max_regions=6,
+    artifacts: Optional[ArtifactSink] = None,
+) -> DetectElementsResponse:
+    """
+    Compares the frame against the previous one and runs OCR and UIED only on the
+    rectangles that changed, keeping the previous elements everywhere else.
+    Falls back to a full perception on the first step or when too much changed
+    """
+    components = None
+    previous = state.components
+    if state.frame is not None and previous is not None:
+        regions = dirty_regions(state.frame.pixels, frame.pixels)
+        dirty_area = sum((r[2] - r[0]) * (r[3] - r[1]) for r in regions)
+        if len(regions) == 0:
+            components = previous
+        elif (
+            len(regions) <= max_regions
+            and dirty_area / (frame.width * frame.height) <= max_dirty_ratio
+        ):
+            components = splice_regions(frame, debug, previous, regions, artifacts)
+
+    if components is None:
+        components = perceive(frame, debug, artifacts=artifacts)
+
+    state.frame = frame
+    state.components = components
+    return components
+
+
+def dirty_regions(
+    previous: np.ndarray, current: np.ndarray, noise=8, pad=32, min_size=1 / 3
+) -> List[Rect]:
+    """
+    Bounding rectangles of the areas that changed between two frames, padded and
+    grown to at least min_size of the screen on each side, as UIED and the text
+    noise filters are tuned relative to the size of the image they look at
+    """
+    height, width = current.shape[:2]
+    if previous.shape != current.shape:
+        return [(0, 0, width, height)]
+
+    diff = cv2.absdiff(previous, current).max(axis=2)
+    mask = (diff > noise).astype(np.uint8)
+    if not mask.any():
+        return []
+    mask = cv2.dilate(mask, np.ones((pad, pad), dtype=np.uint8))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+
+    regions: List[Rect] = []
+    for x, y, w, h, _ in stats[1:count]:
+        x_min, x_max = grow_range(x, x + w, int(width * min_size), width)
+        y_min, y_max = grow_range(y, y + h, int(height * min_size), height)
+        regions.append((x_min, y_min, x_max, y_max))
+
+    # growing can make regions overlap, merge them until none does
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    regions[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return regions
+
+
+def grow_range(start, end, min_length, limit):
+    """
+    Grows [start, end) around its center to at least min_length, shifting it back
+    inside [0, limit) instead of cutting it when it goes over the edges
+    """
+    missing = max(0, min_length - (end - start))
+    start, end = start - missing // 2, end + missing - missing // 2
+    if start < 0:
+        start, end = 0, end - start
+    if end > limit:
+        start, end = max(0, start - (end - limit)), limit
+    return int(start), int(end)
+
+
+def splice_regions(
+    frame: Frame,
+    debug: DebugConfig,
+    previous: DetectElementsResponse,
+    regions: List[Rect],
+    artifacts: Optional[ArtifactSink] = None,
+) -> DetectElementsResponse:
+    """
+    Re-detects the elements inside each region and splices them into the previous
+    elements, which are in the coordinates of the resized image UIED worked on
+    """
+    scale = previous["img_shape"][0] / frame.height
+
+    def to_resized(rect: Rect):
+        return tuple(round(v * scale) for v in rect)
+
+    resized_regions = [to_resized(r) for r in regions]
+
+    def inside(element: Element, region, margin=0):
+        return (
+            element.col_min >= region[0] - margin
+            and element.row_min >= region[1] - margin
+            and element.col_max <= region[2] + margin
+            and element.row_max <= region[3] + margin
+        )
+
+    # elements reaching outside of the region (e.g. the window a text box is in) are
+    # kept, as the region alone would only see a truncated part of them
+    elements = [
+        element
+        for element in previous["compos"]
+        if not any(inside(element, region) for region in resized_regions)
+    ]
+
+    for i, (region, resized_region) in enumerate(zip(regions, resized_regions)):
+        x_min, y_min, x_max, y_max = region
+        crop = Frame(
+            np.ascontiguousarray(frame.pixels[y_min:y_max, x_min:x_max]),
+            name=f"{frame.name}-region{i}",
+        )
+        crop_components = perceive(
+            crop,
+            debug,
+            resized_height=round((y_max - y_min) * scale),
+            artifacts=artifacts,
+        )
+        for element in crop_components["compos"]:
+            element.col_min += resized_region[0]
+            element.col_max += resized_region[0]
+            element.row_min += resized_region[1]
+            element.row_max += resized_region[1]
+            element.init_bound()
+            # drop elements cut by the region border, unless it is the screen border
+            if touches_inner_border(element, resized_region, previous["img_shape"]):
+                continue
+            elements.append(element)
+
+    for element in elements:
+        element.children = []
+        element.parent_id = None
+    reassign_ids(elements)
+    check_containment(elements)
+    return {"compos": elements, "img_shape": previous["img_shape"]}
+
+
+def touches_inner_border(element: Element, region, img_shape, margin=1):
+    height, width = img_shape[:2]
+    return (
+        (region[0] > 0 and element.col_min <= region[0] + margin)
+        or (region[1] > 0 and element.row_min <= region[1] + margin)
+        or (region[2] < width and element.col_max >= region[2] - margin)
+        or (region[3] < height and element.row_max >= region[3] - margin)
+    )
@@ -0,0 +1,223 @@
+from collections import deque
+import hashlib
+import json
+import threading
+from typing import Any, Awaitable, Callable, Deque, Dict, List, TypeVar
+import zipfile
+
+import cv2
+import numpy as np
+
+from driver.frame import Frame
+from driver.input_backend import FakeInputBackend
+from driver.ocr_cache import annotated_image_from_dict, annotated_image_to_dict
+from driver.types import Action, AnnotatedImage, DebugConfig
+
+T = TypeVar("T")
+
+
+class Session:
+    """
+    What goes in and out of the agent on each step: screenshots, OCR responses, LLM
+    responses and executed actions. This one lets a live run through untouched, see
+    SessionRecorder and SessionReplay
+    """
+
+    # True when nothing is requested from the network
+    offline = False
+
+    def screenshot(self, capture: Callable[[], Frame]) -> Frame:
+        return capture()
+
+    def ocr(self, detect: Callable[[], AnnotatedImage]) -> AnnotatedImage:
+        return detect()
+
+    def llm(self, name: str, request: Any, call: Callable[[], T]) -> T:
+        return call()
+
+    async def llm_async(
+        self, name: str, request: Any, call: Callable[[], Awaitable[T]]
+    ) -> T:
+        return await call()
+
+    def action(self, action: Action):
+        pass
+
+    def close(self):
+        pass
+
+
+class SessionRecorder(Session):
+    """
+    Records a live run to a zip archive: the screenshots as png files, everything
+    else as the events of session.json, written when the session is closed
+    """
+
+    def __init__(self, path: str, task: str, debug: DebugConfig):
+        self.path = path
+        self.task = task
+        self.debug = debug
+        self.archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        self.events: List[Dict[str, Any]] = []
+        # file of each screenshot by pixels hash, the screen often stays the same
+        self.screenshots: Dict[str, str] = {}
+        # OCR runs on its own thread in concurrent mode
+        self.lock = threading.Lock()
+
+    def record(self, event: Dict[str, Any]):
+        with self.lock:
+            self.events.append(event)
+
+    def screenshot(self, capture: Callable[[], Frame]) -> Frame:
+        frame = capture()
+        digest = hashlib.sha1(frame.pixels.tobytes()).hexdigest()
+        with self.lock:
+            if digest not in self.screenshots:
+                name = f"screenshots/{len(self.screenshots)}.png"
+                self.screenshots[digest] = name
+                # already compressed
+                self.archive.writestr(
+                    name, frame.encode(".png"), compress_type=zipfile.ZIP_STORED
+                )
+            self.events.append({"type": "screenshot", "file": self.screenshots[digest]})
+        return frame
+
+    def ocr(self, detect: Callable[[], AnnotatedImage]) -> AnnotatedImage:
+        result = detect()
+        self.record({"type": "ocr", "result": annotated_image_to_dict(result)})
+        return result
+
+    def llm(self, name: str, request: Any, call: Callable[[], T]) -> T:
+        response = call()
+        self.record(
+            {"type": "llm", "name": name, "request": request, "response": response}
+        )
+        return response
+
+    async def llm_async(
+        self, name: str, request: Any, call: Callable[[], Awaitable[T]]
+    ) -> T:
+        response = await call()
+        self.record(
+            {"type": "llm", "name": name, "request": request, "response": response}
+        )
+        return response
+
+    def action(self, action: Action):
+        self.record({"type": "action", "action": action})
+
+    def close(self):
+        with self.lock:
+            if self.archive.fp is None:
+                return
+            session = {"task": self.task, "debug": self.debug, "events": self.events}
+            self.archive.writestr("session.json", json.dumps(session))
+            self.archive.close()
+        print(f"Recorded the session to {self.path}")
+
+
+class ReplayError(Exception):
+    pass
+
+
+class SessionReplay(Session):
+    """
+    Plays a recorded session back: screenshots, OCR and LLM responses come from the
+    archive, in the order they were recorded, and the inputs go to a fake backend
+    """
+
+    offline = True
+
+    def __init__(self, path: str):
+        self.archive = zipfile.ZipFile(path)
+        session = json.loads(self.archive.read("session.json"))
+        self.task: str = session["task"]
+        self.debug: DebugConfig = session["debug"]
+        self.events: Dict[str, Deque[Dict[str, Any]]] = {}
+        for event in session["events"]:
+            kind = event["type"] if event["type"] != "llm" else f"llm {event['name']}"
+            self.events.setdefault(kind, deque()).append(event)
+        self.inputs = FakeInputBackend()
+        self.lock = threading.Lock()
+
+    def replay_config(self, debug: DebugConfig) -> DebugConfig:
+        """
+        Recorded config, with what to display and write from the current one, and no
+        settling as the screen only changes when the next screenshot is replayed
+        """
+        replayed = dict(self.debug)
+        for key in ["ocr", "uied", "annotations", "artifacts", "artifacts_every"]:
+            replayed[key] = debug[key]
+        replayed.update(
+            trace=debug["trace"],
+            record=None,
+            replay=debug["replay"],
+            settle_timeout=0,
+            settle_min_wait=0,
+        )
+        replayed["ocr_tiles"] = tuple(replayed["ocr_tiles"])
+        return replayed  # type: ignore
+
+    def next(self, kind: str) -> Dict[str, Any]:
+        with self.lock:
+            events = self.events.get(kind)
+            if not events:
+                raise ReplayError(
+                    f"No {kind} left in the recorded session, the replay diverged from it"
+                )
+            return events.popleft()
+
+    def screenshot(self, capture: Callable[[], Frame]) -> Frame:
+        png = np.frombuffer(self.archive.read(self.next("screenshot")["file"]), np.uint8)
+        frame = Frame(cv2.imdecode(png, cv2.IMREAD_COLOR))
+        self.inputs.screen = frame.to_pil()
+        return frame
+
+    def ocr(self, detect: Callable[[], AnnotatedImage]) -> AnnotatedImage:
+        return annotated_image_from_dict(self.next("ocr")["result"])
+
+    def llm(self, name: str, request: Any, call: Callable[[], T]) -> T:
+        return self.next(f"llm {name}")["response"]
+
+    async def llm_async(
+        self, name: str, request: Any, call: Callable[[], Awaitable[T]]
+    ) -> T:
+        return self.next(f"llm {name}")["response"]
+
+    def action(self, action: Action):
+        recorded = self.next("action")["action"]
+        if recorded != action:
+            print(f"WARN: replayed action {action} differs from the recorded {recorded}")
+
+    def close(self):
+        self.archive.close()
+
+
+def without_images(messages: List[Any]) -> List[Any]:
+    """
+    Chat messages with their base64 images left out, the screenshots being recorded
+    on their own
+    """
+    recorded = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = [
+                {"type": "image_url"} if part.get("type") == "image_url" else part
+                for part in content
+            ]
+            message = {**message, "content": content}
+        recorded.append(message)
+    return recorded
+
+
+session: Session = Session()
+
+
+def current_session() -> Session:
+    return session
+
+
+def set_session(new_session: Session):
+    global session
+    session = new_session
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import numpy as np
+
+from driver.input_backend import input_backend
+
+
+def capture_thumbnail(reduce_factor=8) -> np.ndarray:
+    """
+    Low resolution greyscale capture of the screen, cheap enough to poll and
+    enough to notice anything still repainting
+    """
+    screenshot = input_backend().screenshot()
+    return np.asarray(screenshot.convert("L").reduce(reduce_factor), dtype=np.int16)
+
+
+def changed_ratio(previous: np.ndarray, current: np.ndarray, noise=8) -> float:
+    """
+    Fraction of pixels that changed between two thumbnails, ignoring tiny
+    differences from compression or anti-aliasing noise
+    """
+    if previous.shape != current.shape:
+        return 1.0
+    return float(np.count_nonzero(np.abs(current - previous) > noise)) / current.size
+
+
+async def wait_for_settle(
+    timeout=3.0, threshold=0.001, interval=0.1, stable_frames=1, min_wait=0.0
+) -> float:
+    """
+    Polls the screen until it stops changing for stable_frames consecutive
+    captures, or until timeout seconds have passed
+    :param threshold: fraction of changed pixels still considered as a static screen
+    :param min_wait: right after an input the app may not have started reacting yet,
+                     so until the screen first changes it is only considered settled
+                     once min_wait seconds have passed
+    :return: seconds waited
+    """
+    start = time.monotonic()
+    previous = await asyncio.to_thread(capture_thumbnail)
+    stable = 0
+    changed = False
+    while time.monotonic() - start < timeout:
+        await asyncio.sleep(interval)
+        current = await asyncio.to_thread(capture_thumbnail)
+        if changed_ratio(previous, current) <= threshold:
+            stable += 1
+            if stable >= stable_frames and (
+                changed or time.monotonic() - start >= min_wait
+            ):
+                break
+        else:
+            stable = 0
+            changed = True
+        previous = current
+    return time.monotonic() - start
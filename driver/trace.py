@@ -0,0 +1,90 @@
+import atexit
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from colorama import Fore, Style
+
+
+class Tracer:
+    """
+    Timings of the stages of each step (capture, OCR, UIED stages, LLM, actions,
+    settling), as spans recorded from any thread into the current step.
+    Each finished step is appended as a json line to the export path if there is one,
+    and a summary of every stage is printed on exit
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.export_path: Optional[str] = None
+        self.step: Optional[Dict[str, Any]] = None
+        self.step_start = 0.0
+        self.steps = 0
+        # durations in seconds of every span by name, for the summary
+        self.durations: Dict[str, List[float]] = {}
+
+    def start_step(self):
+        with self.lock:
+            self.step = {"step": self.steps, "time": time.time(), "spans": []}
+            self.step_start = time.perf_counter()
+
+    def end_step(self):
+        with self.lock:
+            step, self.step = self.step, None
+            if step is None:
+                return
+            step["duration"] = time.perf_counter() - self.step_start
+            self.durations.setdefault("step", []).append(step["duration"])
+            self.steps += 1
+        if self.export_path is not None:
+            os.makedirs(os.path.dirname(self.export_path) or ".", exist_ok=True)
+            with open(self.export_path, "a") as f:
+                f.write(json.dumps(step) + "\n")
+
+    def record(self, name: str, start: float, end: float, **attributes):
+        """
+        :param start: time.perf_counter() at the start of the span
+        """
+        with self.lock:
+            self.durations.setdefault(name, []).append(end - start)
+            if self.step is not None:
+                self.step["spans"].append(
+                    {
+                        "name": name,
+                        "start": start - self.step_start,
+                        "duration": end - start,
+                        "thread": threading.current_thread().name,
+                        **attributes,
+                    }
+                )
+
+    def print_summary(self):
+        if len(self.durations) == 0:
+            return
+        print(Fore.CYAN + f"\n\nTimings over {self.steps} steps:")
+        print(f"{'stage':<20}{'count':>7}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for name, durations in self.durations.items():
+            durations = sorted(durations)
+            p50 = durations[len(durations) // 2]
+            p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+            print(
+                f"{name:<20}{len(durations):>7}{sum(durations):>10.2f}"
+                f"{p50 * 1000:>10.0f}{p95 * 1000:>10.0f}{durations[-1] * 1000:>10.0f}"
+            )
+        print(Style.RESET_ALL, end="")
+
+
+tracer = Tracer()
+atexit.register(tracer.print_summary)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.record(name, start, time.perf_counter(), **attributes)
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Dict, List, Literal, Optional, TypedDict, Union
+from typing import Dict, List, Literal, Optional, Tuple, TypedDict, Union
 from openai.types.chat import (
     ChatCompletionAssistantMessageParam,
     ChatCompletionUserMessageParam,
@@ -45,11 +45,32 @@ class ImgMultiplierFactor(TypedDict):
     height: float
 
 
+OCRCacheMode = Literal["off", "exact", "perceptual"]
+
+ArtifactPolicy = Literal["off", "on-error", "always", "sampled"]
+
+
 class DebugConfig(TypedDict):
-    ocr_provider: Optional[Literal["azure", "google", "baidu"]]
+    ocr_provider: Optional[Literal["azure", "google", "baidu", "tesseract"]]
+    ocr_cache: OCRCacheMode
+    ocr_cache_dir: Optional[str]
+    ocr_tiles: Tuple[int, int]
     ocr: bool
     uied: bool
+    artifacts: ArtifactPolicy
+    artifacts_every: int
+    trace: Optional[str]
+    record: Optional[str]
+    replay: Optional[str]
     annotations: bool
+    concurrent: bool
+    incremental: bool
+    settle_timeout: float
+    settle_threshold: float
+    settle_min_wait: float
+
+
+StepState = Literal["capture", "perceive", "plan", "act", "settle"]
 
 
 class Context(TypedDict):
@@ -61,6 +82,7 @@ class Context(TypedDict):
     actions_history: List[List[Action]]
     img_multiplier_factor: ImgMultiplierFactor
     debug: DebugConfig
+    step_state: StepState
 
 
 @dataclass
@@ -1,16 +1,7 @@
-import base64
-import mimetypes
 import subprocess
 import sys
 
 
-def image_to_base64(file_path: str):
-    mime_type, _ = mimetypes.guess_type(file_path)
-    with open(file_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-    return f"data:{mime_type};base64,{encoded_string}"
-
-
 is_retina = False
 if (
     sys.platform == "darwin"
@@ -8,13 +8,44 @@ load_dotenv()
 from driver.executor import start
 
 
+def parse_tiles(value: str):
+    try:
+        rows, _, cols = value.lower().partition("x")
+        rows, cols = int(rows), int(cols or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected ROWS or ROWSxCOLS, got {value}")
+    if rows < 1 or cols < 1:
+        raise argparse.ArgumentTypeError(
+            f"expected at least 1 row and 1 column of tiles, got {value}"
+        )
+    return rows, cols
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("task", type=str, help="The task to execute")
+    parser.add_argument(
+        "task", type=str, nargs="?", help="The task to execute, not needed with --replay"
+    )
     parser.add_argument(
         "--ocr",
-        help="Which OCR provider to use: Azure, Google or Baidu. Default to whatever is set in the .env file",
-        choices=["azure", "google", "baidu"],
+        help="Which OCR provider to use: Azure, Google, Baidu or Tesseract (runs locally, no key needed). Default to whatever is set in the .env file",
+        choices=["azure", "google", "baidu", "tesseract"],
+    )
+    parser.add_argument(
+        "--ocr-cache",
+        help="Reuse OCR results for screenshots seen before, matching the exact pixels or a perceptual hash tolerant to tiny changes. The last 128 results are kept in memory, and up to 512 on disk with --ocr-cache-dir. Default to exact",
+        choices=["off", "exact", "perceptual"],
+        default="exact",
+    )
+    parser.add_argument(
+        "--ocr-cache-dir",
+        help="Also keep the OCR results as json files in this directory, so they are reused across runs. At most 512 files are kept, the least recently used are removed. Default to memory only",
+    )
+    parser.add_argument(
+        "--ocr-tiles",
+        help="Split the screenshot in ROWS or ROWSxCOLS overlapping tiles, OCR'd in parallel and cached separately so only the tiles that changed are sent again. Default to 1, a single image",
+        type=parse_tiles,
+        default=(1, 1),
     )
     parser.add_argument(
         "--debug-ocr",
@@ -26,18 +57,88 @@ def main():
         action="store_true",
         help="Display bounding boxes of UIED detected elements for debugging their position before executing the action",
     )
+    parser.add_argument(
+        "--artifacts",
+        help="When to write the OCR, UIED and annotated images and json of each step to ./output for debugging: never, only for steps that fail, always, or for one step in every --artifacts-every. Default to off",
+        choices=["off", "on-error", "always", "sampled"],
+        default="off",
+    )
+    parser.add_argument(
+        "--artifacts-every",
+        type=int,
+        default=10,
+        help="Write the artifacts of one step in this many with --artifacts sampled. Default to 10",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="Append the timings of the stages of each step to PATH as json lines, e.g. output/trace.jsonl. A summary of the timings is printed on exit either way",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="Record the screenshots, OCR and LLM responses and actions of the session to a zip archive at PATH, to replay it later",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="PATH",
+        help="Replay a session recorded with --record, with its task and settings, without network nor real mouse and keyboard inputs",
+    )
     parser.add_argument(
         "--debug-annotations",
         action="store_true",
         help="Display annotations for debugging their position before executing the action",
     )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="Run the OCR request on a background thread while UI components are detected locally, joining them only to merge the results",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only re-run OCR and UIED on the regions of the screen that changed since the previous step, reusing the previous elements elsewhere",
+    )
+    parser.add_argument(
+        "--settle-timeout",
+        type=float,
+        default=3.0,
+        help="Maximum seconds to wait for the screen to stop changing after actions before taking the next screenshot",
+    )
+    parser.add_argument(
+        "--settle-threshold",
+        type=float,
+        default=0.001,
+        help="Fraction of changed pixels between consecutive low resolution captures still considered a settled screen",
+    )
+    parser.add_argument(
+        "--settle-min-wait",
+        type=float,
+        default=0.5,
+        help="Seconds given to the screen to start changing after an input before a static screen counts as settled. Default to 0.5",
+    )
     args = parser.parse_args()
+    if not args.task and not args.replay:
+        parser.error("the task is required, unless replaying a session")
 
     debug: DebugConfig = {
         "ocr_provider": args.ocr,
+        "ocr_cache": args.ocr_cache,
+        "ocr_cache_dir": args.ocr_cache_dir,
+        "ocr_tiles": args.ocr_tiles,
         "annotations": args.debug_annotations,
         "ocr": args.debug_ocr,
         "uied": args.debug_uied,
+        "artifacts": args.artifacts,
+        "artifacts_every": args.artifacts_every,
+        "trace": args.trace,
+        "record": args.record,
+        "replay": args.replay,
+        "concurrent": args.concurrent,
+        "incremental": args.incremental,
+        "settle_timeout": args.settle_timeout,
+        "settle_threshold": args.settle_threshold,
+        "settle_min_wait": args.settle_min_wait,
     }
 
     start(args.task, debug=debug)